@@ -0,0 +1,200 @@
+import struct
+
+''' Binary property list (bplist00) support.
+
+Only the subset of types needed for compiled storyboards is handled:
+dictionaries, lists, strings, integers, floats and booleans.
+'''
+
+PLIST_FORMAT_BINARY = 'binary'
+PLIST_FORMAT_XML = 'xml'
+
+BPLIST_MAGIC = "bplist00"
+
+_BPLIST_FALSE = 0x08
+_BPLIST_TRUE = 0x09
+_BPLIST_INT = 0x10
+_BPLIST_REAL = 0x20
+_BPLIST_ASCII = 0x50
+_BPLIST_UNICODE = 0x60
+_BPLIST_ARRAY = 0xA0
+_BPLIST_DICT = 0xD0
+
+
+# Returns the plist encoded in the requested format. Uses the stdlib binary
+# writer when it exists (Python 3.4+), and the built-in encoder otherwise.
+def PlistToBytes(obj, fmt = PLIST_FORMAT_BINARY):
+	import plistlib
+	if fmt == PLIST_FORMAT_XML:
+		if hasattr(plistlib, 'dumps'):
+			return plistlib.dumps(obj, fmt = plistlib.FMT_XML)
+		return plistlib.writePlistToString(obj)
+	if fmt != PLIST_FORMAT_BINARY:
+		raise Exception("Unknown plist format: " + str(fmt))
+	if hasattr(plistlib, 'FMT_BINARY'):
+		return plistlib.dumps(obj, fmt = plistlib.FMT_BINARY)
+	return WriteBinaryPlist(obj)
+
+
+def _bplistIntSize(number):
+	if number < 0x100:
+		return 1
+	if number < 0x10000:
+		return 2
+	if number < 0x100000000:
+		return 4
+	return 8
+
+_bplistIntFormats = { 1 : '>B', 2 : '>H', 4 : '>I', 8 : '>Q' }
+
+def _bplistWriteSizedInt(btarray, number, size):
+	btarray.extend(struct.pack(_bplistIntFormats[size], number))
+
+def _bplistWriteInt(btarray, number):
+	if number < 0:
+		btarray.append(_BPLIST_INT | 3)
+		btarray.extend(struct.pack('>q', number))
+		return
+	size = _bplistIntSize(number)
+	btarray.append(_BPLIST_INT | {1 : 0, 2 : 1, 4 : 2, 8 : 3}[size])
+	_bplistWriteSizedInt(btarray, number, size)
+
+def _bplistWriteMarker(btarray, marker, count):
+	if count < 15:
+		btarray.append(marker | count)
+	else:
+		btarray.append(marker | 0x0F)
+		_bplistWriteInt(btarray, count)
+
+
+# Input: A plist-compatible object.
+# Output: A byte array containing the bplist00 representation of the object.
+def WriteBinaryPlist(root):
+	objects = [ ]
+	uniques = { }	# Scalars are uniqued, like Apple's encoder does.
+
+	# Flatten the object graph into a list, with containers holding
+	# the indices of their children.
+	def flatten(obj):
+		ukey = None
+		if isinstance(obj, (basestring, int, long, float)):
+			ukey = (type(obj), obj)
+			if ukey in uniques:
+				return uniques[ukey]
+
+		idx = len(objects)
+		objects.append(None)
+
+		if isinstance(obj, dict):
+			keys = sorted(obj.keys())
+			refs = [ flatten(k) for k in keys ] + [ flatten(obj[k]) for k in keys ]
+			objects[idx] = (_BPLIST_DICT, refs)
+		elif isinstance(obj, (list, tuple)):
+			objects[idx] = (_BPLIST_ARRAY, [ flatten(o) for o in obj ])
+		else:
+			objects[idx] = (None, obj)
+			uniques[ukey] = idx
+		return idx
+
+	flatten(root)
+
+	refsize = _bplistIntSize(len(objects))
+
+	bytes = bytearray(BPLIST_MAGIC)
+	offsets = [ ]
+	for kind, obj in objects:
+		offsets.append(len(bytes))
+		if kind is not None:
+			count = len(obj) / 2 if kind == _BPLIST_DICT else len(obj)
+			_bplistWriteMarker(bytes, kind, count)
+			for ref in obj:
+				_bplistWriteSizedInt(bytes, ref, refsize)
+		elif obj is True:
+			bytes.append(_BPLIST_TRUE)
+		elif obj is False:
+			bytes.append(_BPLIST_FALSE)
+		elif isinstance(obj, (int, long)):
+			_bplistWriteInt(bytes, obj)
+		elif isinstance(obj, float):
+			bytes.append(_BPLIST_REAL | 3)
+			bytes.extend(struct.pack('>d', obj))
+		elif isinstance(obj, basestring):
+			if isinstance(obj, str):
+				obj = obj.decode('utf-8')
+			try:
+				data = obj.encode('ascii')
+				_bplistWriteMarker(bytes, _BPLIST_ASCII, len(data))
+			except UnicodeEncodeError:
+				data = obj.encode('utf-16-be')
+				_bplistWriteMarker(bytes, _BPLIST_UNICODE, len(data) / 2)
+			bytes.extend(data)
+		else:
+			raise Exception("WriteBinaryPlist: Unsupported type " + str(type(obj)))
+
+	offsetTableStart = len(bytes)
+	offsetsize = _bplistIntSize(offsetTableStart)
+	for offset in offsets:
+		_bplistWriteSizedInt(bytes, offset, offsetsize)
+
+	bytes.extend([0] * 6)
+	bytes.append(offsetsize)
+	bytes.append(refsize)
+	bytes.extend(struct.pack('>QQQ', len(objects), 0, offsetTableStart))
+
+	return bytes
+
+
+def _bplistReadSizedInt(bytes, ptr, size):
+	if size == 3:
+		return struct.unpack_from('>I', '\0' + str(bytes[ptr : ptr + 3]))[0]
+	return struct.unpack_from(_bplistIntFormats[size], bytes, ptr)[0]
+
+# Input: A string or bytearray containing a bplist00 archive.
+# Output: The decoded object graph.
+def ReadBinaryPlist(bytes):
+	if str(bytes[0:8]) != BPLIST_MAGIC:
+		raise Exception("ReadBinaryPlist: Not a binary plist.")
+
+	offsetsize, refsize = struct.unpack_from('>BB', bytes, len(bytes) - 26)
+	count, top, tablestart = struct.unpack_from('>QQQ', bytes, len(bytes) - 24)
+	offsets = [ _bplistReadSizedInt(bytes, tablestart + i * offsetsize, offsetsize) for i in range(0, count) ]
+
+	def readCount(ptr, info):
+		if info != 0x0F:
+			return info, ptr
+		size = 1 << (struct.unpack_from('>B', bytes, ptr)[0] & 0x0F)
+		return _bplistReadSizedInt(bytes, ptr + 1, size), ptr + 1 + size
+
+	def readObject(ref):
+		ptr = offsets[ref]
+		marker = struct.unpack_from('>B', bytes, ptr)[0]
+		kind = marker & 0xF0
+		info = marker & 0x0F
+		ptr += 1
+
+		if marker == _BPLIST_FALSE:
+			return False
+		if marker == _BPLIST_TRUE:
+			return True
+		if kind == _BPLIST_INT:
+			if info == 3:
+				return struct.unpack_from('>q', bytes, ptr)[0]
+			return _bplistReadSizedInt(bytes, ptr, 1 << info)
+		if kind == _BPLIST_REAL:
+			return struct.unpack_from('>d' if info == 3 else '>f', bytes, ptr)[0]
+		if kind == _BPLIST_ASCII:
+			length, ptr = readCount(ptr, info)
+			return str(bytes[ptr : ptr + length])
+		if kind == _BPLIST_UNICODE:
+			length, ptr = readCount(ptr, info)
+			return str(bytes[ptr : ptr + length * 2]).decode('utf-16-be')
+		if kind == _BPLIST_ARRAY:
+			length, ptr = readCount(ptr, info)
+			return [ readObject(_bplistReadSizedInt(bytes, ptr + i * refsize, refsize)) for i in range(0, length) ]
+		if kind == _BPLIST_DICT:
+			length, ptr = readCount(ptr, info)
+			refs = [ _bplistReadSizedInt(bytes, ptr + i * refsize, refsize) for i in range(0, length * 2) ]
+			return dict((readObject(refs[i]), readObject(refs[length + i])) for i in range(0, length))
+		raise Exception("ReadBinaryPlist: Unsupported object marker 0x%02X" % (marker))
+
+	return readObject(top)
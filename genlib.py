@@ -1,16 +1,21 @@
 import nibencoding
+import ibprofile
 import struct
+import itertools
+import threading
+import contextlib
 
 ''' Base classes for Nib encoding '''
 
 class NibObject:
 
-	_total = 1000
+	# itertools.count is used so serials stay unique when several threads
+	# build object graphs at once (e.g. in the compile daemon).
+	_serials = itertools.count(1000)
 
 	def __init__(self, classnme = "NSObject"):
 		self._classname = classnme
-		self._serial = NibObject._total
-		NibObject._total += 1
+		self._serial = next(NibObject._serials)
 		self.properties = { }
 		self._nibidx = -1
 		self._repr = None
@@ -354,7 +359,36 @@ This really has (at least) two phases.
 def CompileNibObjects(objects):
 	
 	ctx = CompilationContext()
-	ctx.addObjects(objects)
-	t = ctx.makeTuples()
-
-	return nibencoding.WriteNib(t)
+	with ibprofile.Phase('addObjects'):
+		ctx.addObjects(objects)
+	with ibprofile.Phase('makeTuples'):
+		t = ctx.makeTuples()
+
+	with ibprofile.Phase('WriteNib'):
+		bytes = nibencoding.WriteNib(t)
+	if getattr(_verification, 'enabled', False):
+		import nibverify
+		with ibprofile.Phase('verify'):
+			nibverify.VerifyNib(bytes, t)
+
+	if ibprofile.CurrentHook() is not None:
+		ibprofile.Count('nibs')
+		for name, items in zip([ 'objects', 'keys', 'values', 'classes' ], t):
+			ibprofile.Count(name, len(items))
+		ibprofile.Count('bytes', len(bytes))
+	return bytes
+
+# Per thread, so concurrent compiles in the daemon can differ.
+_verification = threading.local()
+
+# Within the block, every nib CompileNibObjects encodes on this thread is
+# decoded again and checked against what was encoded (see
+# nibverify.VerifyNib). Verification errors are raised from the compile.
+@contextlib.contextmanager
+def VerifyingNibs(enabled = True):
+	previous = getattr(_verification, 'enabled', False)
+	_verification.enabled = enabled
+	try:
+		yield
+	finally:
+		_verification.enabled = previous
@@ -0,0 +1,415 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+
+''' Micro-benchmarks for ibtool.
+
+Usage: ibbench.py <benchmark> [count]
+       ibbench.py suite [OPTIONS] [case ...]
+'''
+
+# Runs fn `repeat` times and returns the best wall time in seconds.
+def besttime(fn, repeat = 5):
+	best = None
+	for i in range(0, repeat):
+		start = time.time()
+		fn()
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+# Compares size and load time of a storyboard Info.plist in the XML and binary formats.
+def bench_plist(count = 500):
+	import plistlib
+	import bplist
+
+	identifierMap = { }
+	for i in range(0, count):
+		name = "UIViewController-%03d-aB-%04d" % (i % 1000, i)
+		identifierMap[name] = name
+	info = {
+		"UIViewControllerIdentifiersToNibNames" : identifierMap,
+		"UIStoryboardVersion" : 1,
+		"UIStoryboardDesignatedEntryPointIdentifier" : name,
+	}
+
+	xml = str(bplist.PlistToBytes(info, bplist.PLIST_FORMAT_XML))
+	binary = str(bplist.PlistToBytes(info, bplist.PLIST_FORMAT_BINARY))
+
+	if hasattr(plistlib, 'loads'):
+		loadxml = lambda: plistlib.loads(xml)
+		loadbinary = lambda: plistlib.loads(binary)
+	else:
+		loadxml = lambda: plistlib.readPlistFromString(xml)
+		loadbinary = lambda: bplist.ReadBinaryPlist(binary)
+
+	assert loadbinary() == loadxml()
+
+	print "Info.plist with %d view controllers" % (count)
+	print "%-8s %10s %12s" % ("format", "bytes", "load (ms)")
+	print "%-8s %10d %12.3f" % ("xml", len(xml), besttime(loadxml) * 1000)
+	print "%-8s %10d %12.3f" % ("binary", len(binary), besttime(loadbinary) * 1000)
+
+TRIVIAL_XIB = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<document type="com.apple.InterfaceBuilder3.CocoaTouch.XIB" version="3.0">
+    <objects>
+        <placeholder placeholderIdentifier="IBFilesOwner" id="-1"/>
+        <placeholder placeholderIdentifier="IBFirstResponder" id="-2"/>
+        <view contentMode="scaleToFill" id="iN0-l3-epB">
+            <rect key="frame" x="0.0" y="0.0" width="320" height="480"/>
+        </view>
+    </objects>
+</document>
+"""
+
+# Measures the wall time of complete ibtool.py invocations on a trivial input,
+# which is dominated by interpreter startup and imports.
+def bench_startup(count = 10):
+	import os
+	import shutil
+	import subprocess
+	import tempfile
+
+	ibtool = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ibtool.py")
+	tmpdir = tempfile.mkdtemp()
+	try:
+		xibpath = os.path.join(tmpdir, "trivial.xib")
+		nibpath = os.path.join(tmpdir, "trivial.nib")
+		with open(xibpath, 'w') as fl:
+			fl.write(TRIVIAL_XIB)
+
+		commands = [
+			("--compile", [ "--compile", nibpath, xibpath ]),
+			("--dump", [ "--dump", nibpath ]),
+		]
+
+		with open(os.devnull, 'w') as devnull:
+			def run(args):
+				subprocess.check_call([ sys.executable, ibtool ] + args, stdout = devnull)
+
+			print "Startup time over %d runs" % (count)
+			print "%-10s %10s %10s" % ("command", "min (ms)", "median (ms)")
+			for name, args in commands:
+				times = [ besttime(lambda: run(args), 1) for i in range(0, count) ]
+				times.sort()
+				print "%-10s %10.1f %10.1f" % (name, times[0] * 1000, times[len(times) / 2] * 1000)
+	finally:
+		shutil.rmtree(tmpdir)
+
+# Returns a XIB with a view holding count labels, for benchmarks that need
+# something bigger than TRIVIAL_XIB.
+def labelsXIB(count):
+	labels = ''.join("""
+                <label opaque="NO" text="Label %d" id="lbl-%d">
+                    <rect key="frame" x="10" y="%d" width="100" height="21"/>
+                    <fontDescription key="fontDescription" type="system" pointSize="17"/>
+                    <color key="textColor" red="0.2" green="0.3" blue="0.4" alpha="1" colorSpace="calibratedRGB"/>
+                </label>""" % (i, i, i * 30) for i in range(0, count))
+	return TRIVIAL_XIB.replace('        </view>', '            <subviews>%s\n            </subviews>\n        </view>' % (labels))
+
+# Compares rewriting every label's text in a compiled nib with nibpatch to
+# recompiling the XIB with the new texts.
+def bench_patch(count = 200):
+	import ibtool
+	import nibpatch
+
+	xib = labelsXIB(count)
+	nib = str(ibtool.ib_compile_xib_bytes(xib))
+	values = dict(((None, 'NS.bytes', "Label %d" % (i)), "Etiquette %d" % (i)) for i in range(0, count))
+	patchedxib = xib.replace('text="Label ', 'text="Etiquette ')
+
+	patched, substitutions = nibpatch.PatchNib(nib, values)
+	assert substitutions == count
+
+	print "Nib with %d labels (%d bytes), %d substitutions" % (count, len(nib), substitutions)
+	print "%-10s %12s" % ("method", "time (ms)")
+	print "%-10s %12.3f" % ("recompile", besttime(lambda: ibtool.ib_compile_xib_bytes(patchedxib)) * 1000)
+	print "%-10s %12.3f" % ("patch", besttime(lambda: nibpatch.PatchNib(nib, values)) * 1000)
+
+# Measures how fast the ibdump section readers decode a large archive.
+def bench_decode(count = 3000):
+	import ibtool
+	import ibdump
+
+	nib = str(ibtool.ib_compile_xib_bytes(labelsXIB(count)))
+	objects, keys, values, classes = ibdump.readNibSectionsFromBytes(nib)
+	elapsed = besttime(lambda: ibdump.readNibSectionsFromBytes(nib))
+
+	print "Nib with %d labels: %d bytes, %d objects, %d values" % (count, len(nib), len(objects), len(values))
+	print "%-14s %10.3f" % ("decode (ms)", elapsed * 1000)
+	print "%-14s %10.2f" % ("MB/s", len(nib) / elapsed / (1 << 20))
+	print "%-14s %10.0f" % ("values/s", len(values) / elapsed)
+
+	# The object table alone, with and without NumPy (see ibdump._numpy).
+	sections = ibdump.readHeader(nib, 14)
+	threshold = ibdump._NUMPY_MIN_OBJECTS
+	try:
+		ibdump._NUMPY_MIN_OBJECTS = len(objects) + 1
+		print "%-14s %10.3f" % ("objects (ms)", besttime(lambda: ibdump.readObjects(nib, sections[0])) * 1000)
+		if ibdump._numpy() is not None:
+			ibdump._NUMPY_MIN_OBJECTS = 0
+			print "%-14s %10.3f" % ("NumPy (ms)", besttime(lambda: ibdump.readObjects(nib, sections[0])) * 1000)
+	finally:
+		ibdump._NUMPY_MIN_OBJECTS = threshold
+
+# Compares decoding a whole large nib to looking up objects in it through
+# an mmap-backed ibdump.NibArchive.
+def bench_archive(count = 3000):
+	import os
+	import random
+	import tempfile
+	import ibtool
+	import ibdump
+
+	nib = str(ibtool.ib_compile_xib_bytes(labelsXIB(count)))
+	fd, path = tempfile.mkstemp(suffix = ".nib")
+	try:
+		with os.fdopen(fd, 'wb') as fl:
+			fl.write(nib)
+
+		def lookup(n):
+			with ibdump.OpenNibArchive(path) as archive:
+				for i in range(0, n):
+					archive.object(random.randrange(0, len(archive)))
+
+		def find():
+			with ibdump.OpenNibArchive(path) as archive:
+				return list(archive.find('UILabel'))
+
+		print "Nib with %d labels: %d bytes" % (count, len(nib))
+		print "%-26s %10s" % ("operation", "time (ms)")
+		print "%-26s %10.3f" % ("readNibFile", besttime(lambda: ibdump.readNibFile(path)) * 1000)
+		print "%-26s %10.3f" % ("NibArchive, 1 object", besttime(lambda: lookup(1)) * 1000)
+		print "%-26s %10.3f" % ("NibArchive, 100 objects", besttime(lambda: lookup(100)) * 1000)
+		print "%-26s %10.3f" % ("NibArchive, find UILabel", besttime(find) * 1000)
+	finally:
+		os.unlink(path)
+
+# The synthetic documents of the suite, as (name, kind, ibgen parameters).
+SUITE = [
+	('xib-small', 'xib', { 'depth' : 2, 'subviews' : 3 }),
+	('xib-large', 'xib', { 'depth' : 5, 'subviews' : 4, 'constraints' : 4, 'outlets' : 20 }),
+	('storyboard-small', 'storyboard', { 'scenes' : 5 }),
+	('storyboard-large', 'storyboard', { 'scenes' : 40, 'depth' : 3, 'cells' : 4, 'segues' : 2, 'outlets' : 5 }),
+]
+
+# The phases timed by the suite. handlers is the time spent in xibparser
+# building the object graph, i.e. the total minus all other phases.
+PHASES = [ 'parse', 'handlers', 'addObjects', 'makeTuples', 'WriteNib', 'total' ]
+
+# Absolute differences below these are never reported as regressions, so
+# that noise in the small cases doesn't fail the comparison.
+_REGRESSION_FLOORS = { 'ms' : 1.0, 'kb' : 1024 }
+
+# Replaces the function owner.name with one that adds its run time to
+# times[phase], and returns a function that restores the original.
+def _timePhase(owner, name, times, phase, results = None):
+	original = getattr(owner, name)
+	def timed(*args, **kwargs):
+		start = time.time()
+		try:
+			result = original(*args, **kwargs)
+		finally:
+			times[phase] += time.time() - start
+		if results is not None:
+			results.append(result)
+		return result
+	setattr(owner, name, timed)
+	return lambda: setattr(owner, name, original)
+
+# Compiles the case's document once and returns the time of each phase in
+# seconds, the number of objects encoded and the size of the output.
+def _compileCase(kind, document):
+	import xml.etree.ElementTree as ET
+	import genlib
+	import nibencoding
+	import ibtool
+
+	times = dict((phase, 0.0) for phase in PHASES)
+	tuples = [ ]
+	restores = [
+		_timePhase(genlib.CompilationContext, 'addObjects', times, 'addObjects'),
+		_timePhase(genlib.CompilationContext, 'makeTuples', times, 'makeTuples', tuples),
+		_timePhase(nibencoding, 'WriteNib', times, 'WriteNib'),
+	]
+	try:
+		start = time.time()
+		tree = ET.ElementTree(ET.fromstring(document))
+		times['parse'] = time.time() - start
+		if kind == 'xib':
+			outputs = [ ibtool.ib_compile_xib_bytes(tree) ]
+		else:
+			outputs = ibtool.ib_compile_storyboard_bytes(tree).values()
+		times['total'] = time.time() - start
+	finally:
+		for restore in restores:
+			restore()
+
+	times['handlers'] = times['total'] - sum(times[phase] for phase in PHASES if phase not in [ 'handlers', 'total' ])
+	return times, sum(len(t[0]) for t in tuples), sum(len(output) for output in outputs)
+
+# Runs a case of the suite `repeat` times and returns its results, with the
+# phase times of the fastest run. Runs in a fresh process (see RunSuite), so
+# the peak RSS is the case's own.
+def _runCase(args):
+	import resource
+	import ibgen
+	import ibwriter
+	import xibparser	# Imported lazily by ibtool, which the first run shouldn't pay for.
+	name, kind, params, repeat = args
+	document = ibgen.GenerateXIB(**params) if kind == 'xib' else ibgen.GenerateStoryboard(**params)
+
+	best = None
+	with open(os.devnull, 'w') as devnull:
+		stdout = sys.stdout
+		sys.stdout = devnull	# xibparser's progress output
+		try:
+			for i in range(0, repeat):
+				times, objects, size = _compileCase(kind, document)
+				if best is None or times['total'] < best['total']:
+					best = times
+		finally:
+			sys.stdout = stdout
+
+	result = dict((phase + '_ms', best[phase] * 1000) for phase in PHASES)
+	result.update({
+		'kind' : kind,
+		'params' : params,
+		'document_bytes' : len(document),
+		'objects' : objects,
+		'output_bytes' : size,
+		# Kilobytes on Linux, bytes on OS X.
+		'peak_rss_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform == 'darwin' else 1),
+	})
+	return result
+
+# Runs every case of the suite in its own process and returns the results
+# as a dictionary of case name -> result.
+def RunSuite(repeat = 3, cases = None):
+	import multiprocessing
+	results = { }
+	for name, kind, params in SUITE:
+		if cases and name not in cases:
+			continue
+		pool = multiprocessing.Pool(1)
+		try:
+			results[name] = pool.apply(_runCase, [ (name, kind, params, repeat) ])
+		finally:
+			pool.close()
+			pool.join()
+	return results
+
+# Returns the regressions of results against baseline as a list of (case,
+# metric, baseline value, value) tuples. A metric regresses if it grew by
+# more than threshold percent and by more than its floor.
+def CompareResults(baseline, results, threshold = 10.0):
+	regressions = [ ]
+	for name in sorted(results.keys()):
+		if name not in baseline:
+			continue
+		for metric in sorted(results[name].keys()):
+			unit = metric.rsplit('_', 1)[-1]
+			if unit not in _REGRESSION_FLOORS or metric not in baseline[name]:
+				continue
+			old, new = baseline[name][metric], results[name][metric]
+			if new > old * (1 + threshold / 100.0) and new - old > _REGRESSION_FLOORS[unit]:
+				regressions.append((name, metric, old, new))
+	return regressions
+
+def _printSuite(results, baseline = None):
+	row = "%-18s %8s" + " %10s" * (len(PHASES) + 1)
+	print "Times in ms, peak RSS in KB"
+	print row % (("case", "objects") + tuple(PHASES) + ("peak RSS",))
+	metrics = [ phase + '_ms' for phase in PHASES ] + [ 'peak_rss_kb' ]
+	for name, kind, params in SUITE:
+		if name not in results:
+			continue
+		result = results[name]
+		print row % ((name, result['objects']) + tuple(("%d" if m.endswith('_kb') else "%.1f") % (result[m]) for m in metrics))
+		if baseline and name in baseline:
+			old = baseline[name]
+			print row % (("", "") + tuple("%+.0f%%" % (100.0 * result[m] / old[m] - 100) if old.get(m) else "-" for m in metrics))
+
+# Where the first run of the suite on a machine records its results. Timings
+# depend on the machine, so this file is local and not part of the repository;
+# later runs compare against it with --baseline.
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ibbench-baseline.json")
+
+SUITE_USAGE = '''Usage: ibbench.py suite [OPTIONS] [case ...]
+  --repeat <n>         compile each case n times and keep the fastest (default: 3)
+  --out <path>         write the results as JSON to path
+  --baseline <path>    compare the results against JSON results written by --out,
+                       and exit with status 1 if any of them regressed
+  --threshold <pct>    how much slower or bigger than the baseline a result may be (default: 10)
+
+The first run without --baseline or --out also records its results in
+ibbench-baseline.json next to ibbench.py, to compare later runs against.'''
+
+def _writeResults(path, results):
+	import json
+	with open(path, 'w') as fl:
+		json.dump({ 'python' : sys.version.split()[0], 'cases' : results }, fl, indent = 1, sort_keys = True)
+
+# Times the compile phases of synthetic documents generated by ibgen.py, see
+# SUITE_USAGE for the options.
+def bench_suite(argv):
+	import getopt
+	import json
+	ops, cases = getopt.gnu_getopt(argv, '', [ 'repeat=', 'out=', 'baseline=', 'threshold=' ])
+	options = dict(ops)
+	unknown = [ c for c in cases if c not in [ name for name, kind, params in SUITE ] ]
+	if unknown:
+		print "Unknown cases:", ', '.join(unknown)
+		print SUITE_USAGE
+		sys.exit(1)
+
+	baseline = None
+	if '--baseline' in options:
+		with open(options['--baseline'], 'rb') as fl:
+			baseline = json.load(fl)['cases']
+
+	results = RunSuite(int(options.get('--repeat', 3)), cases)
+	_printSuite(results, baseline)
+
+	if '--out' in options:
+		_writeResults(options['--out'], results)
+	elif baseline is None and not cases and not os.path.exists(BASELINE):
+		_writeResults(BASELINE, results)
+		print "Recorded these results in %s; compare later runs with --baseline %s." % (BASELINE, BASELINE)
+
+	if baseline is not None:
+		threshold = float(options.get('--threshold', 10))
+		regressions = CompareResults(baseline, results, threshold)
+		for name, metric, old, new in regressions:
+			print "Regression: %s %s %.1f -> %.1f (%+.0f%%)" % (name, metric, old, new, 100.0 * new / old - 100)
+		if regressions:
+			sys.exit(1)
+		print "No regressions over %g%%." % (threshold)
+
+def main():
+	if sys.argv[1:2] == [ 'suite' ]:
+		bench_suite(sys.argv[2:])
+		return
+
+	benchmarks = {
+		'archive' : bench_archive,
+		'decode' : bench_decode,
+		'patch' : bench_patch,
+		'plist' : bench_plist,
+		'startup' : bench_startup,
+	}
+
+	if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+		print "Usage: ibbench.py <benchmark> [count]"
+		print "       ibbench.py suite [OPTIONS] [case ...]"
+		print "Benchmarks:", ', '.join(sorted(benchmarks.keys()))
+		sys.exit(1)
+
+	args = [ int(a) for a in sys.argv[2:] ]
+	benchmarks[sys.argv[1]](*args)
+
+if __name__ == '__main__':
+	main()
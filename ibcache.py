@@ -0,0 +1,266 @@
+import os
+import struct
+import hashlib
+
+''' Content-addressed on-disk cache of compiled outputs.
+
+Entries are keyed by a hash of the input bytes, the compiler version and the
+options that affect the output, and hold every file a compile produced as a
+name -> bytes mapping. Each entry is a single file under <cache dir>/entries,
+written to a temporary file first and renamed into place, so processes sharing
+the cache never see partial entries. Hits bump the entry's mtime. The total
+size of the entries is kept in <cache dir>/size, and once it grows past the
+size limit the cache is walked and the least recently used entries are removed.
+
+ParsedInputCache is the in-memory counterpart used by --daemon, which keeps
+parsed inputs around between compiles.
+'''
+
+CACHE_FORMAT_VERSION = 1
+
+# Modules whose code determines the compiled output.
+_COMPILER_MODULES = [ 'genlib', 'nibencoding', 'xibparser', 'bplist' ]
+
+_compiler_version = None
+
+# Returns the paths of the source files that determine the compiled output.
+def CompilerSources():
+	here = os.path.dirname(os.path.abspath(__file__))
+	return [ os.path.join(here, name + ".py") for name in _COMPILER_MODULES ]
+
+# Returns a digest of the compiler's source, so entries written by other
+# versions of ibtool are never reused.
+def CompilerVersion():
+	global _compiler_version
+	if _compiler_version is None:
+		digest = hashlib.sha1(str(CACHE_FORMAT_VERSION))
+		for path in CompilerSources():
+			with open(path, 'rb') as fl:
+				digest.update(fl.read())
+		_compiler_version = digest.hexdigest()
+	return _compiler_version
+
+# Parses sizes like "500M" or "2G" into a number of bytes.
+def ParseSize(text):
+	units = { 'K' : 1 << 10, 'M' : 1 << 20, 'G' : 1 << 30 }
+	text = text.strip().upper().rstrip('B')
+	if text and text[-1] in units:
+		return int(float(text[:-1]) * units[text[-1]])
+	return int(text)
+
+
+# Packs a name -> bytes mapping into one string: for each file, its name
+# length and data length as little-endian words, then the name and the data.
+# This is the format of cache entries and of compile farm results.
+def PackFiles(files):
+	parts = [ ]
+	for name in sorted(files.keys()):
+		data = str(files[name])
+		parts.append(struct.pack("<II", len(name), len(data)))
+		parts.append(name)
+		parts.append(data)
+	return ''.join(parts)
+
+# Returns the name -> bytes mapping packed into blob by PackFiles. Raises
+# ValueError if blob is truncated.
+def UnpackFiles(blob):
+	files = { }
+	ptr = 0
+	while ptr < len(blob):
+		namelen, datalen = struct.unpack_from("<II", blob, ptr)
+		ptr += 8
+		name = blob[ptr : ptr + namelen]
+		ptr += namelen
+		files[name] = blob[ptr : ptr + datalen]
+		ptr += datalen
+		if ptr > len(blob):
+			raise ValueError("Truncated cache entry.")
+	return files
+
+
+class CompileCache(object):
+	DEFAULT_MAX_SIZE = 1 << 30
+
+	def __init__(self, path, maxsize = None):
+		self.path = path
+		self.maxsize = maxsize or CompileCache.DEFAULT_MAX_SIZE
+		self.hits = 0
+		self.misses = 0
+
+	def _entriesdir(self):
+		return os.path.join(self.path, "entries")
+
+	def _entrypath(self, key):
+		return os.path.join(self._entriesdir(), key[0:2], key)
+
+	# Returns the cache key for compiling inbytes as the given kind of
+	# document ('xib' or 'storyboard') with the given options.
+	def key(self, inbytes, kind, options = None):
+		digest = hashlib.sha1(CompilerVersion())
+		digest.update('\0' + kind + '\0')
+		for name, value in sorted((options or { }).items()):
+			digest.update("%s=%r\0" % (name, value))
+		digest.update(inbytes)
+		return digest.hexdigest()
+
+	# Returns the name -> bytes mapping stored for key, or None.
+	def lookup(self, key):
+		path = self._entrypath(key)
+		try:
+			with open(path, 'rb') as fl:
+				files = UnpackFiles(fl.read())
+		except (IOError, OSError, ValueError, struct.error):
+			self.misses += 1
+			return None
+
+		try:
+			os.utime(path, None)
+		except OSError:
+			pass # Evicted by another process in the meantime. The data is still good.
+		self.hits += 1
+		return files
+
+	def store(self, key, files):
+		import tempfile
+		path = self._entrypath(key)
+		dirname = os.path.dirname(path)
+		if not os.path.isdir(dirname):
+			try:
+				os.makedirs(dirname)
+			except OSError:
+				if not os.path.isdir(dirname):
+					raise
+
+		blob = PackFiles(files)
+		fd, tmppath = tempfile.mkstemp(prefix = ".tmp-", dir = dirname)
+		try:
+			with os.fdopen(fd, 'wb') as fl:
+				fl.write(blob)
+			os.chmod(tmppath, 0644)
+			# The entry this replaces, if any, is measured and replaced under the
+			# lock, so the running total stays right when processes store the
+			# same key at once.
+			with self._lock():
+				try:
+					replaced = os.stat(path).st_size
+				except OSError:
+					replaced = 0
+				os.rename(tmppath, path)
+				self._grow(len(blob) - replaced)
+		except:
+			if os.path.exists(tmppath):
+				os.unlink(tmppath)
+			raise
+
+	def _sizepath(self):
+		return os.path.join(self.path, "size")
+
+	# Returns the open lock file, locked exclusively. Closing it unlocks it.
+	def _lock(self):
+		import fcntl
+		lockfile = open(os.path.join(self.path, "lock"), 'a')
+		try:
+			fcntl.flock(lockfile, fcntl.LOCK_EX)
+		except:
+			lockfile.close()
+			raise
+		return lockfile
+
+	# The total size of the entries is kept in the size file, updated under
+	# the lock, so that stores don't have to walk the whole cache. Returns
+	# None if it's missing or unreadable.
+	def _readsize(self):
+		try:
+			with open(self._sizepath(), 'rb') as fl:
+				return int(fl.read())
+		except (IOError, OSError, ValueError):
+			return None
+
+	def _writesize(self, total):
+		with open(self._sizepath(), 'wb') as fl:
+			fl.write("%d\n" % max(0, total))
+
+	# Adds delta bytes to the running total, and evicts entries once it
+	# exceeds maxsize. The cache is only walked when the total is unknown or
+	# too large. Must be called with the lock held.
+	def _grow(self, delta):
+		total = self._readsize()
+		if total is None:
+			total = self._scan()[1]
+		else:
+			total += delta
+		if total > self.maxsize:
+			total = self._evict()
+		self._writesize(total)
+
+	# Returns a list of (mtime, size, path) for every entry, and their total size.
+	def _scan(self):
+		entries = [ ]
+		total = 0
+		for dirpath, dirnames, filenames in os.walk(self._entriesdir()):
+			for filename in filenames:
+				if filename.startswith(".tmp-"):
+					continue
+				fullpath = os.path.join(dirpath, filename)
+				try:
+					st = os.stat(fullpath)
+				except OSError:
+					continue
+				entries.append((st.st_mtime, st.st_size, fullpath))
+				total += st.st_size
+		return entries, total
+
+	# Removes least recently used entries until the cache fits in maxsize,
+	# and returns the remaining total. Must be called with the lock held.
+	def _evict(self):
+		entries, total = self._scan()
+		entries.sort()
+		for mtime, size, fullpath in entries:
+			if total <= self.maxsize:
+				break
+			try:
+				os.unlink(fullpath)
+			except OSError:
+				pass
+			total -= size
+		return total
+
+	def stats(self):
+		return "%d hits, %d misses" % (self.hits, self.misses)
+
+
+class ParsedInputCache(object):
+	''' Keeps recently loaded inputs in memory, keyed by path and mtime.
+	Entries are dropped in least recently used order beyond maxentries. '''
+
+	def __init__(self, maxentries = 256):
+		import collections
+		import threading
+		self._entries = collections.OrderedDict()
+		self._maxentries = maxentries
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	# Returns loader(path), reusing the previous result if the file
+	# hasn't changed since.
+	def get(self, path, loader):
+		st = os.stat(path)
+		key = (os.path.abspath(path), loader)
+		stamp = (st.st_mtime, st.st_size)
+
+		with self._lock:
+			entry = self._entries.pop(key, None)
+			if entry and entry[0] == stamp:
+				self._entries[key] = entry
+				self.hits += 1
+				return entry[1]
+			self.misses += 1
+
+		value = loader(path)
+
+		with self._lock:
+			self._entries[key] = (stamp, value)
+			while len(self._entries) > self._maxentries:
+				self._entries.popitem(last = False)
+		return value
@@ -0,0 +1,186 @@
+import os
+import sys
+import contextlib
+import socket
+import struct
+import threading
+import SocketServer
+from cStringIO import StringIO
+
+from ibframing import SendMessage, RecvMessage
+
+''' Resident compile daemon.
+
+`ibtool.py --daemon <socket>` keeps the interpreter, its imports and a cache
+of parsed inputs warm, and runs ibtool command lines sent over a Unix domain
+socket. `ibtool.py --connect <socket> ...` forwards its remaining arguments
+to the daemon and prints the result, as if it had run them itself.
+
+Messages are framed by ibframing.
+Request payload:  the client's working directory and its arguments, NUL separated.
+Response payload: a 4 byte big-endian exit status, then the command's output.
+'''
+
+DEFAULT_SOCKET_PATH = "/tmp/ibtool-%d.sock" % (os.getuid())
+
+
+class _ThreadLocalStdout(object):
+	''' Routes writes to a per-thread buffer while a request is being served,
+	so prints from concurrent requests end up in their own responses. '''
+
+	def __init__(self, stream):
+		self._stream = stream
+		self._local = threading.local()
+
+	def capture(self, buffer):
+		self._local.buffer = buffer
+
+	def _target(self):
+		return getattr(self._local, 'buffer', None) or self._stream
+
+	def write(self, data):
+		self._target().write(data)
+
+	def flush(self):
+		self._target().flush()
+
+	# Temporarily sends this thread's writes to stream, and yields the stream
+	# they went to before.
+	@contextlib.contextmanager
+	def redirected(self, stream):
+		previous = self._target()
+		self._local.buffer = stream
+		try:
+			yield previous
+		finally:
+			self._local.buffer = previous
+
+	def __getattr__(self, name):
+		return getattr(self._stream, name)
+
+
+# Rewrites path arguments in argv to be absolute with respect to cwd, since
+# the daemon serves clients in many working directories.
+def _absolutizeArgs(argv, cwd):
+	import getopt
+	import ibtool
+	ops, args = getopt.getopt(argv, ibtool.IB_SHORT_OPTIONS, ibtool.IB_LONG_OPTIONS)
+	def absolute(path):
+		if path == '-':
+			return path
+		return os.path.join(cwd, path)
+
+	def takesvalue(option):
+		if option.startswith('--'):
+			return option[2:] + '=' in ibtool.IB_LONG_OPTIONS
+		return option[1] + ':' in ibtool.IB_SHORT_OPTIONS
+
+	result = []
+	for option, value in ops:
+		if option in ibtool.IB_PATH_OPTIONS:
+			value = absolute(value)
+		result.append(option)
+		if takesvalue(option):
+			result.append(value)
+	result.append('--')
+	result.extend(absolute(a) for a in args)
+	return result
+
+
+# Options that start a server or a watcher of their own, which clients can't
+# run inside the daemon.
+_SERVING_OPTIONS = [ '--daemon', '--connect', '--worker', '--watch' ]
+
+class _RequestHandler(SocketServer.BaseRequestHandler):
+	def handle(self):
+		import ibtool
+		import traceback
+
+		try:
+			request = RecvMessage(self.request).split('\0')
+		except EOFError:
+			return
+
+		cwd, argv = request[0], request[1:]
+		output = StringIO()
+		sys.stdout.capture(output)
+		status = 0
+		try:
+			argv = _absolutizeArgs(argv, cwd)
+			options = argv[0 : argv.index('--')]
+			for option in _SERVING_OPTIONS:
+				if option in options:
+					print "Error: %s is not supported through the daemon." % (option)
+					sys.exit(1)
+			if '-' in argv[argv.index('--') + 1:]:
+				print "Error: Reading input from stdin is not supported through the daemon."
+				sys.exit(1)
+			ibtool.main(argv)
+		except SystemExit as e:
+			status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+		except Exception:
+			output.write(traceback.format_exc())
+			status = 1
+		finally:
+			sys.stdout.capture(None)
+
+		SendMessage(self.request, struct.pack(">I", status) + output.getvalue())
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+
+# Returns whether a server accepts connections on the Unix socket at path.
+def _isListening(path):
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(path)
+	except socket.error:
+		return False
+	finally:
+		sock.close()
+	return True
+
+def RunDaemon(socketpath = None):
+	import ibtool
+	import ibcache
+
+	socketpath = socketpath or DEFAULT_SOCKET_PATH
+	if os.path.exists(socketpath):
+		if _isListening(socketpath):
+			print "Error: Another daemon is already listening on %s." % (socketpath)
+			sys.exit(1)
+		os.unlink(socketpath) # Left behind by a daemon that was killed.
+
+	# Turn SIGTERM into SystemExit, so the socket is removed below.
+	import signal
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+	ibtool.ib_set_input_cache(ibcache.ParsedInputCache())
+	sys.stdout = _ThreadLocalStdout(sys.stdout)
+
+	server = _Server(socketpath, _RequestHandler)
+	sys.stdout.write("ibtool daemon listening on %s\n" % (socketpath))
+	sys.stdout.flush()
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		os.unlink(socketpath)
+
+# Sends argv to the daemon at socketpath, prints its output and returns its exit status.
+def RunClient(argv, socketpath = None):
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.connect(socketpath or DEFAULT_SOCKET_PATH)
+	try:
+		SendMessage(sock, '\0'.join([os.getcwd()] + list(argv)))
+		response = RecvMessage(sock)
+	finally:
+		sock.close()
+
+	status = struct.unpack(">I", response[0:4])[0]
+	sys.stdout.write(response[4:])
+	return status
@@ -3,15 +3,38 @@
 import os
 import sys
 import struct
-
-def rword(bytes):
-	return struct.unpack("<I", bytes)[0]
-def rquad(bytes):
-	return struct.unpack("<q", bytes)[0]
-def rdouble(bytes):
-	return struct.unpack("<d", bytes)[0]
-def rsingle(bytes):
-	return struct.unpack("<f", bytes)[0]
+import collections
+
+# The section readers work on a memoryview of the archive and read
+# fixed-width fields with precompiled structs at an offset, so nothing is
+# copied except the keys, class names and values they return. They accept
+# anything memoryview() does: a str, a bytearray, or a memoryview of e.g. an
+# archive nested in another one.
+
+_BYTE = struct.Struct("<B")
+_WORD = struct.Struct("<I")
+_SHORT = struct.Struct("<H")
+_QUAD = struct.Struct("<q")
+_SINGLE = struct.Struct("<f")
+_DOUBLE = struct.Struct("<d")
+
+# Payload sizes of the value encodings other than strings (0x08), which
+# are prefixed with their length.
+FIXED_VALUE_SIZES = { 0x00 : 1, 0x01 : 2, 0x02 : 4, 0x03 : 8, 0x04 : 0, 0x05 : 0, 0x06 : 4, 0x07 : 8, 0x09 : 0, 0x0A : 4 }
+
+def _view(bytes):
+	if isinstance(bytes, memoryview):
+		return bytes
+	return memoryview(bytes)
+
+def rword(bytes, offset = 0):
+	return _WORD.unpack_from(bytes, offset)[0]
+def rquad(bytes, offset = 0):
+	return _QUAD.unpack_from(bytes, offset)[0]
+def rdouble(bytes, offset = 0):
+	return _DOUBLE.unpack_from(bytes, offset)[0]
+def rsingle(bytes, offset = 0):
+	return _SINGLE.unpack_from(bytes, offset)[0]
 
 # Reads a flexible number from the bytes array and returns a tuple
 # containing the number read and the number of bytes read.
@@ -32,138 +55,463 @@ def readFlexNumber(bytes, addr):
 			raise Exception("Flex number invalid or too large.")
 	return (number, ptr - addr)
 
+# Like readFlexNumber, but returns the number and the address after it.
+# Numbers below 0x80, the most common case by far, take a single byte
+# and are decoded without a call.
+def _readFlex(buf, ptr):
+	num = ord(buf[ptr])
+	if num & 0x80:
+		return (num & 0x7F, ptr + 1)
+	number, length = readFlexNumber(buf, ptr)
+	return (number, ptr + length)
+
 def readHeader(bytes, start):
-	hsize = rword(bytes[start : start+4])
+	buf = _view(bytes)
+	hsize = rword(buf, start)
 	# print "Header size (words): " + str(hsize)
 	sections = []
 	sectionDataStart = start + 4
 	for section in range(0, (hsize - 1)/2):
-		objcount = rword(bytes[sectionDataStart + section * 8 : sectionDataStart + section * 8 + 4])
-		address = rword(bytes[sectionDataStart + section * 8 + 4 : sectionDataStart + section * 8 + 8])
+		objcount = rword(buf, sectionDataStart + section * 8)
+		address = rword(buf, sectionDataStart + section * 8 + 4)
 		sections += [(objcount, address)]
 	return sections
 
+# Returns the address where section index of the sections readHeader returned
+# ends: the start of the section after it in the file, or size, the length of
+# the archive, for the last one.
+def sectionEnd(sections, index, size):
+	start = sections[index][1]
+	return min([ address for count, address in sections if address > start ] + [ size ])
+
 def readKeys(bytes, keysSection):
+	buf = _view(bytes)
 	count, ptr = keysSection
 	keys = []
-	for i in range(0, count):
-		
-		rd = readFlexNumber(bytes, ptr)
-		length = rd[0]
-		ptr += rd[1]
-
-		keys.append(str(bytes[ptr : ptr + length]))
+	for i in xrange(0, count):
+		length, ptr = _readFlex(buf, ptr)
+		keys.append(buf[ptr : ptr + length].tobytes())
 		ptr += length
 	return keys
 
-def readObjects(bytes, objectsSection):
+# NumPy is optional. With it, object tables of at least _NUMPY_MIN_OBJECTS
+# entries are decoded with vectorized operations; below that, its fixed
+# cost per call is more than the Python loop takes.
+_NUMPY_MIN_OBJECTS = 256
+
+# The numpy module, None if it isn't installed, or False until _numpy first
+# looks. Python 2 doesn't remember failed imports, so this does.
+_numpyModule = False
+
+def _numpy():
+	global _numpyModule
+	if _numpyModule is False:
+		try:
+			import numpy
+			_numpyModule = numpy
+		except ImportError:
+			_numpyModule = None
+	return _numpyModule
+
+# Decodes count consecutive flex numbers starting at address start in one
+# go. A flex number ends at the first byte with the high bit set, so the
+# numbers' boundaries are found by looking for those bytes, and the 7-bit
+# groups are shifted in place and summed per number. Only the bytes before
+# end are looked at. Returns the numbers as an array and the address after
+# the last one.
+def _readFlexArray(numpy, bytes, start, count, end):
+	size = max(0, min(end, len(bytes), start + count * 5) - start)
+	if isinstance(bytes, memoryview):
+		window = numpy.frombuffer(bytes[start : start + size].tobytes(), numpy.uint8)
+	else:
+		window = numpy.frombuffer(bytes, numpy.uint8, size, start)
+	ends = numpy.flatnonzero(window & 0x80)[0:count]
+	if len(ends) < count:
+		raise Exception("Flex numbers truncated at address %d." % (start + len(window)))
+	begins = numpy.empty_like(ends)
+	begins[0] = 0
+	begins[1:] = ends[:-1] + 1
+	lengths = ends - begins + 1
+	if lengths.max() > 5:
+		raise Exception("Flex number invalid or too large.")
+
+	used = window[0 : ends[-1] + 1]
+	groups = (used & 0x7F).astype(numpy.int64)
+	if len(used) > count:
+		shifts = numpy.arange(len(used)) - numpy.repeat(begins, lengths)
+		groups <<= 7 * shifts
+		numbers = numpy.add.reduceat(groups, begins)
+	else:
+		numbers = groups	# All numbers are a single byte.
+	return numbers, start + len(used)
+
+# Returns the object table as three integer arrays: the class index, the
+# first value index and the value count of each object. They are NumPy
+# arrays if NumPy is installed, otherwise array.array('L')s. end is where the
+# objects section ends (see sectionEnd), by default the end of bytes.
+def readObjectTable(bytes, objectsSection, end = None):
 	count, ptr = objectsSection
-	objects = []
-	for i in range(0, count):
-		r0 = readFlexNumber(bytes, ptr)
-		r1 = readFlexNumber(bytes, ptr + r0[1])
-		r2 = readFlexNumber(bytes, ptr + r0[1] + r1[1])
-
-		class_idx = r0[0]
-		start_idx = r1[0]
-		size = r2[0]
-
-		ptr += r0[1] + r1[1] + r2[1]
+	numpy = _numpy()
+	if numpy is None:
+		import array
+		columns = zip(*readObjects(bytes, objectsSection, end)) or [ [ ], [ ], [ ] ]
+		return tuple(array.array('L', column) for column in columns)
+	if count == 0:
+		empty = numpy.zeros(0, numpy.int64)
+		return (empty, empty, empty)
+	numbers, ptr = _readFlexArray(numpy, bytes, ptr, count * 3, len(bytes) if end is None else end)
+	table = numbers.reshape(count, 3)
+	return (table[:, 0], table[:, 1], table[:, 2])
+
+def readObjects(bytes, objectsSection, end = None):
+	count, ptr = objectsSection
+	if count >= _NUMPY_MIN_OBJECTS and _numpy() is not None:
+		class_idxs, starts, sizes = readObjectTable(bytes, objectsSection, end)
+		return zip(class_idxs.tolist(), starts.tolist(), sizes.tolist())
 
+	buf = _view(bytes)
+	objects = []
+	for i in xrange(0, count):
+		class_idx, ptr = _readFlex(buf, ptr)
+		start_idx, ptr = _readFlex(buf, ptr)
+		size, ptr = _readFlex(buf, ptr)
 		objects.append((class_idx, start_idx, size))
 	return objects
 
 def readClasses(bytes, classSection):
-	count, addr = classSection
+	buf = _view(bytes)
+	count, ptr = classSection
 	classes = []
-	ptr = addr
-	for i in range(0, count):
-		r = readFlexNumber(bytes, ptr)
-		length = r[0]
-		ptr += r[1]
-		
-		tp = ord(bytes[ptr])
+	for i in xrange(0, count):
+		length, ptr = _readFlex(buf, ptr)
+
+		tp = ord(buf[ptr])
 		ptr += 1
-		
+
 		unknown = None
 		assert(tp in [0x80, 0x81])
 		if tp == 0x81:
-			unknown = rword(bytes[ptr : ptr + 4])
+			unknown = rword(buf, ptr)
 			ptr += 4
-			print 'readClasses: Mystery value:', unknown, '(',
 
-		classes.append(str(bytes[ptr : ptr + length - 1]))
+		classes.append(buf[ptr : ptr + length - 1].tobytes())
 
+		# Reported on stderr, so JSON dumps on stdout stay valid.
 		if unknown:
-			print classes[-1], ')'
+			sys.stderr.write("readClasses: Mystery value: %d ( %s )\n" % (unknown, classes[-1]))
 
 		ptr += length
 
 	return classes
 
-def readValues(bytes, valuesSection, debugKeys = []):
-	count, addr = valuesSection
+class NibObjectRef(int):
+	''' The index of the object a value refers to. Prints as '@<index>'. '''
+
+	def __str__(self):
+		return '@%d' % (self)
+
+	__repr__ = __str__
+
+# Value decoders, indexed by encoding. Fixed size numbers are (unpack_from,
+# size) pairs, called straight from C. Constants are (None, value). The rest
+# are (decoder, None), where the decoder takes the buffer and the address of
+# the value's payload and returns the value and the address after it.
+
+def _decodeObjectRef(buf, ptr):
+	return (NibObjectRef(_WORD.unpack_from(buf, ptr)[0]), ptr + 4)
+
+_FLOAT_TUPLES = { }
+
+# Strings that start with 0x07 hold a tuple of doubles, like a CGPoint
+# (17 bytes) or CGRect (33 bytes).
+def _decodeString(buf, ptr):
+	length = ord(buf[ptr])
+	if length & 0x80:
+		length &= 0x7F
+		ptr += 1
+	else:
+		length, ptr = _readFlex(buf, ptr)
+	end = ptr + length
+	if length > 1 and buf[ptr] == '\x07' and (length - 1) % 8 == 0:
+		fmt = _FLOAT_TUPLES.get(length)
+		if fmt is None:
+			fmt = _FLOAT_TUPLES[length] = struct.Struct('<' + 'd' * ((length - 1) / 8))
+		return (fmt.unpack_from(buf, ptr + 1), end)
+	value = buf[ptr : end]
+	return (value if isinstance(value, str) else value.tobytes(), end)
+
+_VALUE_DECODERS = [
+	(_BYTE.unpack_from, 1),		# 0x00 byte
+	(_SHORT.unpack_from, 2),	# 0x01 short
+	(_WORD.unpack_from, 4),		# 0x02 4 byte integer
+	(_QUAD.unpack_from, 8),		# 0x03 8 byte integer
+	(None, False),				# 0x04 false
+	(None, True),				# 0x05 true
+	(_SINGLE.unpack_from, 4),	# 0x06 float
+	(_DOUBLE.unpack_from, 8),	# 0x07 double
+	(_decodeString, None),		# 0x08 string, data or tuple of doubles
+	(None, None),				# 0x09 nil
+	(_decodeObjectRef, None),	# 0x0A object reference
+]
+
+# Returns a list of (key index, value, encoding) tuples. Object references
+# are NibObjectRefs. A str is indexed directly, which is faster than going
+# through a memoryview, and other buffers are viewed without copying.
+def readValues(bytes, valuesSection):
+	buf = bytes if isinstance(bytes, str) else _view(bytes)
+	count, ptr = valuesSection
 	values = []
-	ptr = addr
-	for i in range(0, count):
-		r = readFlexNumber(bytes, ptr)
-		key_idx = r[0]
-		ptr += r[1]
+	append = values.append
+	decoders = _VALUE_DECODERS
+	for i in xrange(0, count):
+		key_idx = ord(buf[ptr])
+		if key_idx & 0x80:
+			key_idx &= 0x7F
+			ptr += 1
+		else:
+			key_idx, ptr = _readFlex(buf, ptr)
 
-		encoding = ord(bytes[ptr])
+		encoding = ord(buf[ptr])
+		if encoding >= len(decoders):
+			raise Exception("Unknown value encoding 0x%02X in value %d (key %d) at address %d." % (encoding, i, key_idx, ptr))
 		ptr += 1
+		decode, size = decoders[encoding]
+		if decode is None:
+			value = size
+		elif size is None:
+			value, ptr = decode(buf, ptr)
+		else:
+			value = decode(buf, ptr)[0]
+			ptr += size
+		append((key_idx, value, encoding))
+	return values
 
-		value = None
-		if encoding == 0x00:	# single byte
-			value = ord(bytes[ptr])
+# Returns the address after the count values starting at ptr, without
+# decoding them.
+def _skipValues(buf, ptr, count):
+	for i in xrange(0, count):
+		if ord(buf[ptr]) & 0x80:
 			ptr += 1
-		elif encoding == 0x01:	# short
-			value = struct.unpack("<H", bytes[ptr : ptr + 2])[0]
-			ptr += 2
-		elif encoding == 0x03:  # 8 byte integer
-			value = rquad(bytes[ptr:ptr+8])
-			ptr += 8
-		elif encoding == 0x04:
-			value = False
-		elif encoding == 0x05:	# true
-			value = True
-		elif encoding == 0x06:	# word
-			# if len(debugKeys):
-				# print "Found encoding with 0x6", debugKeys[key_idx]
-			value = rsingle(bytes[ptr:ptr+4])
-			ptr += 4
-		elif encoding == 0x07:	# floating point
-			value = rdouble(bytes[ptr:ptr+8])
-			ptr += 8
-		elif encoding == 0x08:	# string
-			r = readFlexNumber(bytes, ptr)
-			length = r[0]
-			ptr += r[1]
-			if length and ord(bytes[ptr]) == 0x07:
-				if length == 17:
-					value = struct.unpack("<dd", bytes[ptr + 1 : ptr + 17])
-				elif length == 33:
-					value = struct.unpack("<dddd", bytes[ptr + 1 : ptr + 33])
-				else:
-					raise Exception("Well this is weird.")
-			else:
-				value = str(bytes[ptr : ptr + length])
+		else:
+			key_idx, ptr = _readFlex(buf, ptr)
+		encoding = ord(buf[ptr])
+		ptr += 1
+		if encoding == 0x08:
+			length, ptr = _readFlex(buf, ptr)
 			ptr += length
-		elif encoding == 0x09:	# nil?
-			value = None
-		elif encoding == 0x0A:	# object
-			value = '@' + str(rword(bytes[ptr:ptr+4])) #object is stored as a 4 byte index.
-			ptr += 4
+		elif encoding in FIXED_VALUE_SIZES:
+			ptr += FIXED_VALUE_SIZES[encoding]
 		else:
-			# print "dumping classes:", globals()['classes']
-			print "dumping keys:" #, globals()['keys']
-			for n, key in enumerate(globals()['keys']):
-				print "%X\t%X\t%s" % (n, (n | 0x80), key)
-			raise Exception("Unknown value encoding (key %d idx %d addr %d): " % (key_idx, i, ptr-1) + str(encoding))
-		values.append((key_idx, value, encoding))
-	return values
-
-def fancyPrintObjects(nib, prefix="", showencoding=False):
+			raise Exception("Unknown value encoding %d at %d." % (encoding, ptr - 1))
+	return ptr
+
+# Yields a (start, payload start, end, key index, encoding) tuple for each
+# value in the values section, without decoding the values themselves. For
+# strings, the payload starts after the length.
+def readValueSpans(bytes, valuesSection):
+	buf = bytes if isinstance(bytes, str) else _view(bytes)
+	count, ptr = valuesSection
+	for i in xrange(0, count):
+		start = ptr
+		key_idx = ord(buf[ptr])
+		if key_idx & 0x80:
+			key_idx &= 0x7F
+			ptr += 1
+		else:
+			key_idx, ptr = _readFlex(buf, ptr)
+		encoding = ord(buf[ptr])
+		ptr += 1
+		if encoding == 0x08:
+			length, ptr = _readFlex(buf, ptr)
+			payload = ptr
+			ptr += length
+		elif encoding in FIXED_VALUE_SIZES:
+			payload = ptr
+			ptr += FIXED_VALUE_SIZES[encoding]
+		else:
+			raise Exception("Unknown value encoding %d at %d." % (encoding, ptr - 1))
+		yield (start, payload, ptr, key_idx, encoding)
+
+# Number of entries between the checkpoints of NibArchive's indexes.
+_INDEX_STRIDE = 64
+
+class NibArchive(object):
+	''' Random access to the objects of a nib, decoding only what is asked for.
+
+	data is the archive as a str or an mmap (see OpenNibArchive). Keys and
+	class names are decoded on first use. The object and value tables are
+	indexed by remembering the address of every _INDEX_STRIDE-th entry, so
+	looking up object(i) reads at most that many entries before decoding the
+	object's own values, and the index stays small even for huge archives.
+	'''
+
+	def __init__(self, data):
+		if data[0:10] != "NIBArchive":
+			raise ValueError("Not a NIBArchive.")
+		self._data = data
+		hsize = rword(data, 14)
+		self.sections = readHeader(data[0 : 18 + (hsize - 1) * 4], 14)
+		self._keys = None
+		self._classes = None
+		self._objectTable = None	# readObjectTable's arrays, with NumPy
+		self._objectIndex = None
+		self._valueIndex = None
+
+	def close(self):
+		if hasattr(self._data, 'close'):
+			self._data.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		self.close()
+
+	def __len__(self):
+		return self.sections[0][0]
+
+	# Returns a copy of the bytes of the section with the given index.
+	def _section(self, index):
+		start = self.sections[index][1]
+		ends = [ address for count, address in self.sections if address > start ]
+		return self._data[start : min(ends) if ends else len(self._data)]
+
+	def keys(self):
+		if self._keys is None:
+			self._keys = readKeys(self._section(1), (self.sections[1][0], 0))
+		return self._keys
+
+	def classes(self):
+		if self._classes is None:
+			self._classes = readClasses(self._section(3), (self.sections[3][0], 0))
+		return self._classes
+
+	# Yields the (class index, first value index, value count) entry of each
+	# object, starting with object first at address ptr.
+	def _objectEntries(self, first = 0, ptr = None):
+		data = self._data
+		if ptr is None:
+			ptr = self.sections[0][1]
+		for i in xrange(first, len(self)):
+			class_idx, ptr = _readFlex(data, ptr)
+			start_idx, ptr = _readFlex(data, ptr)
+			size, ptr = _readFlex(data, ptr)
+			yield (class_idx, start_idx, size, ptr)
+
+	def _objectEntry(self, index):
+		import array
+		if not 0 <= index < len(self):
+			raise IndexError("Object index %d out of range." % (index))
+		if self._objectTable is None and len(self) >= _NUMPY_MIN_OBJECTS and _numpy() is not None:
+			self._objectTable = readObjectTable(self._data, self.sections[0], sectionEnd(self.sections, 0, len(self._data)))
+		if self._objectTable is not None:
+			return tuple(int(column[index]) for column in self._objectTable)
+		if self._objectIndex is None:
+			self._objectIndex = array.array('L', [ self.sections[0][1] ])
+			for i, entry in enumerate(self._objectEntries()):
+				if (i + 1) % _INDEX_STRIDE == 0:
+					self._objectIndex.append(entry[3])
+
+		checkpoint = index / _INDEX_STRIDE
+		entries = self._objectEntries(checkpoint * _INDEX_STRIDE, self._objectIndex[checkpoint])
+		for i in xrange(0, index % _INDEX_STRIDE):
+			entries.next()
+		return entries.next()[0:3]
+
+	# Returns the address of the value with the given index.
+	def _valueAddress(self, index):
+		import array
+		data = self._data
+		count, start = self.sections[2]
+		if self._valueIndex is None:
+			self._valueIndex = array.array('L', [ start ])
+			ptr = start
+			for i in xrange(_INDEX_STRIDE, count, _INDEX_STRIDE):
+				ptr = _skipValues(data, ptr, _INDEX_STRIDE)
+				self._valueIndex.append(ptr)
+
+		checkpoint = index / _INDEX_STRIDE
+		return _skipValues(data, self._valueIndex[checkpoint], index % _INDEX_STRIDE)
+
+	def classname(self, index):
+		return self.classes()[self._objectEntry(index)[0]]
+
+	# Returns the class name of object index, and its values as a list of
+	# (key, value, encoding) tuples. Values are decoded like readValues does.
+	def object(self, index):
+		class_idx, start, count = self._objectEntry(index)
+		address = self._valueAddress(start)
+		end = _skipValues(self._data, address, count)
+		keys = self.keys()
+		values = [ (keys[key_idx], value, encoding) for key_idx, value, encoding in readValues(self._data[address : end], (count, 0)) ]
+		return (self.classes()[class_idx], values)
+
+	# Yields the indexes of the objects of class classname.
+	def find(self, classname):
+		classes = self.classes()
+		if classname not in classes:
+			return
+		class_idx = classes.index(classname)
+		numpy = _numpy()
+		if numpy is not None and len(self) >= _NUMPY_MIN_OBJECTS:
+			if self._objectTable is None:
+				self._objectTable = readObjectTable(self._data, self.sections[0], sectionEnd(self.sections, 0, len(self._data)))
+			for index in numpy.flatnonzero(self._objectTable[0] == class_idx).tolist():
+				yield index
+			return
+		for index, entry in enumerate(self._objectEntries()):
+			if entry[0] == class_idx:
+				yield index
+
+# Opens the nib at path as a NibArchive backed by a read-only memory map,
+# so only the parts of the file that are accessed are read in.
+def OpenNibArchive(path):
+	import mmap
+	with open(path, 'rb') as fl:
+		data = mmap.mmap(fl.fileno(), 0, access = mmap.ACCESS_READ)
+	try:
+		return NibArchive(data)
+	except:
+		data.close()
+		raise
+
+class NestedArchive(object):
+	''' A NIBArchive embedded in an NS.bytes value, decoded on first access. '''
+
+	def __init__(self, data):
+		self.data = data
+		self._nib = None
+
+	def __len__(self):
+		return len(self.data)
+
+	# The archive's sections, as returned by readNibSectionsFromBytes.
+	@property
+	def nib(self):
+		if self._nib is None:
+			self._nib = readNibSectionsFromBytes(self.data)
+		return self._nib
+
+# Returns whether bytes[start:end] (by default all of bytes) holds a
+# NIBArchive, as the payload of a value may. Only its first bytes are
+# looked at.
+def isNibArchive(bytes, start = 0, end = None):
+	if end is None:
+		end = len(bytes)
+	return end - start > 40 and bytes[start : start + 10] == "NIBArchive"
+
+# Returns a NestedArchive for the value if it is an embedded NIBArchive,
+# otherwise None.
+def nestedArchive(key, value, encoding):
+	if encoding != 0x08 or key != 'NS.bytes' or not isinstance(value, str):
+		return None
+	if not isNibArchive(value):
+		return None
+	return NestedArchive(value)
+
+# maxdepth: How many levels of nested archives to print. None prints all of
+# them; deeper archives are only listed with their size.
+def fancyPrintObjects(nib, prefix="", showencoding=False, maxdepth=None):
 	objects, keys, values, classes = nib
 	for o_idx, object in enumerate(objects):
 		#print object
@@ -175,16 +523,17 @@ def fancyPrintObjects(nib, prefix="", showencoding=False):
 		for v in obj_values:
 			# print v
 			k_str = keys[v[0]]
-			v_str = str(v[1])
+			subnib = nestedArchive(k_str, v[1], v[2])
 
-			printSubNib = k_str == 'NS.bytes' and len(v_str) > 40 and v_str.startswith('NIBArchive')
+			if subnib is not None and maxdepth is not None and maxdepth <= 0:
+				print prefix + '\t' + k_str + " = Encoded NIB Archive (%d bytes)" % (len(subnib))
 
-			if printSubNib:
+			elif subnib is not None:
 				print prefix + '\t' + k_str + " = Encoded NIB Archive"
-				nib = readNibSectionsFromBytes(v[1])
-				fancyPrintObjects(nib, prefix + "\t", showencoding)
+				fancyPrintObjects(subnib.nib, prefix + "\t", showencoding, None if maxdepth is None else maxdepth - 1)
 
 			else: # Boring regular data.
+				v_str = str(v[1])
 				if showencoding:
 					print prefix + '\t' + k_str + ' = (' + str(v[2]) + ')', v_str
 				else:
@@ -194,12 +543,128 @@ def fancyPrintObjects(nib, prefix="", showencoding=False):
 			# 	with open('embedded.nib', 'wb') as f:
 			# 		f.write(v[1])
 
+# Names of the value encodings in JSON dumps.
+_JSON_TYPES = { 0x00 : 'byte', 0x01 : 'short', 0x02 : 'int32', 0x03 : 'int64', 0x04 : 'bool', 0x05 : 'bool',
+	0x06 : 'float', 0x07 : 'double', 0x08 : 'string', 0x09 : 'nil', 0x0A : 'object' }
+
+_INFINITY = float('inf')
+
+# JSON has no NaN or infinities, so they are written as the strings "NaN",
+# "Infinity" and "-Infinity".
+def _jsonFloat(value):
+	if value != value:
+		return 'NaN'
+	if value == _INFINITY:
+		return 'Infinity'
+	if value == -_INFINITY:
+		return '-Infinity'
+	return value
+
+# Returns the JSON record of a value. Object references become integers,
+# strings that aren't UTF-8 are base64 encoded with type 'data', nested
+# archives become a list of object records with type 'archive', or null
+# below maxdepth (see fancyPrintObjects), and non-finite floats become
+# strings (see _jsonFloat).
+def _jsonValue(key, value, encoding, maxdepth = None):
+	valuetype = _JSON_TYPES.get(encoding, str(encoding))
+	subnib = nestedArchive(key, value, encoding)
+	if encoding == 0x0A:
+		value = int(value)
+	elif subnib is not None:
+		valuetype = 'archive'
+		value = None
+		if maxdepth is None or maxdepth > 0:
+			value = list(nibRecords(subnib.nib, None if maxdepth is None else maxdepth - 1))
+	elif encoding == 0x08 and isinstance(value, tuple):
+		valuetype = 'floats'
+		value = [ _jsonFloat(v) for v in value ]
+	elif encoding == 0x06 or encoding == 0x07:
+		value = _jsonFloat(value)
+	elif encoding == 0x08:
+		try:
+			value.decode('utf-8')
+		except UnicodeDecodeError:
+			import base64
+			valuetype = 'data'
+			value = base64.b64encode(value)
+
+	record = collections.OrderedDict()
+	record['key'] = key
+	record['type'] = valuetype
+	record['value'] = value
+	return record
+
+# Yields a JSON record for each object of nib, the tuple returned by
+# readNibSectionsFromBytes.
+def nibRecords(nib, maxdepth = None):
+	objects, keys, values, classes = nib
+	for o_idx, object in enumerate(objects):
+		record = collections.OrderedDict()
+		record['index'] = o_idx
+		record['class'] = classes[object[0]]
+		record['values'] = [ _jsonValue(keys[v[0]], v[1], v[2], maxdepth) for v in values[object[1] : object[1] + object[2]] ]
+		yield record
+
+# Writes the objects of nib to stream as a JSON array ('json'), or as one
+# JSON document per line ('ndjson'). Records are encoded one at a time and
+# written in chunks, so the whole document is never held in memory.
+def writeJSON(nib, stream, fmt = 'json', maxdepth = None):
+	import json
+	encoder = json.JSONEncoder(separators = (',', ':'), allow_nan = False)
+	ndjson = fmt == 'ndjson'
+	chunk = [ '' if ndjson else '[' ]
+	chunksize = 0
+	for n, record in enumerate(nibRecords(nib, maxdepth)):
+		text = encoder.encode(record)
+		if ndjson:
+			chunk.append(text + '\n')
+		else:
+			chunk.append((',\n' if n else '\n') + text)
+		chunksize += len(text)
+		if chunksize >= 1 << 16:
+			stream.write(''.join(chunk))
+			chunk = [ ]
+			chunksize = 0
+	chunk.append('' if ndjson else '\n]\n')
+	stream.write(''.join(chunk))
+
+# Returns a dictionary of statistics about nib, the tuple returned by
+# readNibSectionsFromBytes: the number of objects, keys, values and classes,
+# the number of archives nested in NS.bytes values, and Counters of the
+# objects per class, values per key and values per encoding. The counts
+# include the nested archives.
+def nibStatistics(nib):
+	stats = {
+		'objects' : 0, 'keys' : 0, 'values' : 0, 'classes' : 0, 'nested' : 0,
+		'classcounts' : collections.Counter(),
+		'keycounts' : collections.Counter(),
+		'encodings' : collections.Counter(),
+	}
+
+	def add(nib):
+		objects, keys, values, classes = nib
+		stats['objects'] += len(objects)
+		stats['keys'] += len(keys)
+		stats['values'] += len(values)
+		stats['classes'] += len(classes)
+		stats['classcounts'].update(classes[o[0]] for o in objects)
+		stats['keycounts'].update(keys[v[0]] for v in values)
+		stats['encodings'].update(v[2] for v in values)
+		for key_idx, value, encoding in values:
+			subnib = nestedArchive(keys[key_idx], value, encoding)
+			if subnib is not None:
+				stats['nested'] += 1
+				add(subnib.nib)
+
+	add(nib)
+	return stats
+
 def readNibSectionsFromBytes(bytes):
 	sections = readHeader(bytes, 14)
 	# print sections
 	classes = readClasses(bytes, sections[3])
 	# print classes
-	objects = readObjects(bytes, sections[0])
+	objects = readObjects(bytes, sections[0], sectionEnd(sections, 0, len(bytes)))
 	# print objects
 	keys = readKeys(bytes, sections[1])
 	# print keys
@@ -207,23 +672,46 @@ def readNibSectionsFromBytes(bytes):
 	# print values
 	return (objects, keys, values, classes)
 
-def ibdump(filename, showencoding=None):
-	with open(filename, 'rb') as file:
-		filebytes = file.read()
+# Reads a nib file, given its path or a file object. Returns a tuple of the
+# file's bytes and its decoded sections, which are None if the file isn't
+# a NIBArchive.
+def readNibFile(filename):
+	if isinstance(filename, basestring):
+		with open(filename, 'rb') as file:
+			filebytes = file.read()
+	else:
+		filebytes = filename.read()
+
+	nib = None
+	if str(filebytes[0:10]) == "NIBArchive":
+		nib = readNibSectionsFromBytes(filebytes)
+	return (filebytes, nib)
+
+# loaded: The result of readNibFile(filename), if the caller already has it.
+# fmt: 'json' or 'ndjson' to write the objects as JSON (see writeJSON)
+#      instead of the readable format.
+# maxdepth: How many levels of nested archives to decode (see fancyPrintObjects).
+def ibdump(filename, showencoding=None, loaded=None, fmt=None, maxdepth=None):
+	filebytes, nib = loaded or readNibFile(filename)
+
+	if fmt in ['json', 'ndjson']:
+		if nib is None:
+			sys.stderr.write("\"%s\" is not a NIBArchive file.\n" % (filename))
+			sys.exit(1)
+		writeJSON(nib, sys.stdout, fmt, maxdepth)
+		return
 
 	pfx = filebytes[0:10]
 	print "Prefix: " + pfx
 
-	headers = filebytes[10:10+4]
-	headers = rword(headers)
+	headers = rword(filebytes, 10)
 	print "Headers: " + str(headers)
 
-	if str(pfx) != "NIBArchive":
+	if nib is None:
 		print "\"%s\" is not a NIBArchive file." % (filename)
 		return
 
-	nib = readNibSectionsFromBytes(filebytes)
-	fancyPrintObjects(nib, showencoding=showencoding)
+	fancyPrintObjects(nib, showencoding=showencoding, maxdepth=maxdepth)
 
 if __name__ == '__main__':
 	ibdump(filename = sys.argv[1])
\ No newline at end of file
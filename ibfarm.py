@@ -0,0 +1,260 @@
+import os
+import sys
+import socket
+import struct
+import SocketServer
+
+from ibframing import SendMessage, RecvMessage
+
+''' Distributed compiles over TCP.
+
+`ibtool.py --worker [host:]port` runs a compile worker. A coordinator
+(`ibtool.py --compile <out> --workers host:port,... <inputs>`) reads each
+input, ships its bytes to the workers and writes the compiled files they
+send back. If a worker dies mid-job, the job is retried on another worker.
+`--local-workers <n>` starts n workers on the loopback interface instead,
+which is handy for trying the farm on a single machine.
+
+Jobs are whole documents: a storyboard's scenes refer to each other (e.g.
+through segues), so they are compiled together.
+
+Messages use the same framing as the daemon (see ibframing).
+Job payload:    kind ('xib' or 'storyboard'), plist format, input bytes, NUL separated.
+Result payload: a 4 byte big-endian status, then the packed output files
+                (see ibcache.PackFiles) on success, or the error on failure.
+'''
+
+DEFAULT_PORT = 7755
+DEFAULT_RETRIES = 2
+DEFAULT_TIMEOUT = 300
+
+# Splits "host:port" or "port" into a (host, port) tuple.
+def ParseAddress(text, defaulthost = 'localhost'):
+	host, sep, port = text.rpartition(':')
+	return (host or defaulthost, int(port or DEFAULT_PORT))
+
+
+# Compiles one job payload and returns the result payload.
+def _runJob(payload):
+	import traceback
+	import ibtool
+	import ibcache
+	try:
+		kind, plistformat, inbytes = payload.split('\0', 2)
+		if kind == 'xib':
+			files = { 'nib' : ibtool.ib_compile_xib_bytes(inbytes) }
+		elif kind == 'storyboard':
+			files = ibtool.ib_compile_storyboard_bytes(inbytes, plistformat or None)
+		else:
+			raise ValueError("Unknown document kind '%s'." % (kind))
+	except Exception:
+		return struct.pack(">I", 1) + traceback.format_exc()
+	return struct.pack(">I", 0) + ibcache.PackFiles(files)
+
+
+class _WorkerHandler(SocketServer.BaseRequestHandler):
+	# Coordinators keep their connection open and send one job after another.
+	def handle(self):
+		while True:
+			try:
+				payload = RecvMessage(self.request)
+			except (EOFError, socket.error):
+				return
+			SendMessage(self.request, _runJob(payload))
+
+
+class _WorkerServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+
+
+# Listens on the loopback interface unless address names a host, e.g.
+# 0.0.0.0:7755 to accept coordinators on every interface.
+def RunWorker(address):
+	host, port = ParseAddress(address, '127.0.0.1')
+	server = _WorkerServer((host, port), _WorkerHandler)
+
+	# The first line of stdout carries the address, which StartLocalWorkers
+	# reads to learn the port. Anything printed while compiling goes to stderr.
+	sys.stdout.write("ibtool worker listening on %s:%d\n" % server.server_address)
+	sys.stdout.flush()
+	sys.stdout = sys.stderr
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+# Starts count workers on the loopback interface. Returns the worker processes
+# and their addresses; the caller stops them with StopLocalWorkers.
+def StartLocalWorkers(count):
+	import subprocess
+	ibtool = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ibtool.py")
+	processes = [ subprocess.Popen([ sys.executable, ibtool, '--worker', '127.0.0.1:0' ], stdout = subprocess.PIPE)
+		for i in range(0, count) ]
+
+	addresses = [ ]
+	for process in processes:
+		line = process.stdout.readline()
+		if not line:
+			StopLocalWorkers(processes)
+			raise RuntimeError("A local worker failed to start.")
+		addresses.append(ParseAddress(line.split()[-1]))
+	return processes, addresses
+
+def StopLocalWorkers(processes):
+	for process in processes:
+		if process.poll() is None:
+			process.terminate()
+	for process in processes:
+		process.wait()
+
+
+class _Job(object):
+	def __init__(self, inpath, outpath, kind, payload, key):
+		self.inpath = inpath
+		self.outpath = outpath
+		self.kind = kind
+		self.payload = payload
+		self.key = key
+		self.attempts = 0
+
+# Writes the compiled files of a job to its output path.
+def _writeOutputs(inpath, outpath, kind, files):
+	import ibtool
+	import ibwriter
+	outdir = os.path.dirname(outpath)
+	if outdir and not os.path.isdir(outdir):
+		os.makedirs(outdir)
+	if kind == 'xib':
+		ibtool.ib_write_nib(inpath, outpath, files['nib'])
+		return
+	with ibwriter.OpenSink(outpath, clean = True) as sink:
+		for name in sorted(files.keys()):
+			sink.write(name, files[name])
+
+# Compiles the (input path, output path) pairs in work on the workers at
+# addresses, a list of (host, port) tuples, using one connection per worker.
+# A job whose worker dies is put back in the queue and tried again, up to
+# retries more times. A worker that can't be reached or has died is not used
+# again. Compile errors reported by a worker are not retried.
+# Returns the list of (input path, error) tuples for the files that failed.
+def CompileOnWorkers(work, addresses, plistformat = None, cache = None, retries = DEFAULT_RETRIES, timeout = DEFAULT_TIMEOUT):
+	import threading
+	import time
+	import Queue
+	import ibtool
+	import ibcache
+
+	jobs = Queue.Queue()
+	results = Queue.Queue()
+	failures = [ ]
+	done = 0
+
+	def finish(inpath, outpath, kind, files, error, where):
+		if error:
+			failures.append((inpath, error))
+			print "FAILED %s" % (inpath)
+			print error
+			return
+		_writeOutputs(inpath, outpath, kind, files)
+		print "compiled %s -> %s (%s)" % (inpath, outpath, where)
+
+	for inpath, outpath in work:
+		try:
+			inbytes = ibtool.ib_read_input(inpath)
+		except IOError as e:
+			finish(inpath, outpath, None, None, str(e), None)
+			done += 1
+			continue
+
+		kind = os.path.splitext(inpath)[1][1:]
+		if kind not in [ 'xib', 'storyboard' ]:
+			kind = ibtool.ib_document_kind(inbytes)
+		if kind is None:
+			finish(inpath, outpath, None, None, "Only .xib and .storyboard files are currently supported.", None)
+			done += 1
+			continue
+
+		options = { 'plistformat' : plistformat or 'binary' } if kind == 'storyboard' else None
+		key = cache and cache.key(inbytes, kind, options)
+		files = cache and cache.lookup(key)
+		if files:
+			finish(inpath, outpath, kind, files, None, "cached")
+			done += 1
+			continue
+
+		jobs.put(_Job(inpath, outpath, kind, "%s\0%s\0%s" % (kind, plistformat or '', inbytes), key))
+
+	def run(address):
+		where = "%s:%d" % address
+		sock = None
+		while True:
+			job = jobs.get()
+			if job is None:
+				break
+			start = time.time()
+			try:
+				if sock is None:
+					sock = socket.create_connection(address, timeout)
+				SendMessage(sock, job.payload)
+				response = RecvMessage(sock)
+			except (socket.error, EOFError) as e:
+				job.attempts += 1
+				if job.attempts > retries:
+					results.put((job, None, "Gave up after %d attempts, the last on %s: %s" % (job.attempts, where, e), where, 0))
+				else:
+					jobs.put(job)
+				break
+			results.put((job, response, None, where, time.time() - start))
+
+		if sock is not None:
+			sock.close()
+		# Sent after any retried job is back in the queue, so the main thread
+		# knows there is no work left in flight once every worker has stopped.
+		results.put(None)
+
+	threads = [ ]
+	if not jobs.empty():
+		for address in addresses:
+			t = threading.Thread(target = run, args = (address,), name = "CompileOnWorkers-%s:%d" % address)
+			t.daemon = True
+			t.start()
+			threads.append(t)
+
+	alive = len(threads)
+	while done < len(work):
+		if alive == 0:
+			job = jobs.get_nowait()
+			finish(job.inpath, job.outpath, job.kind, None, "No workers left to compile on.", None)
+			done += 1
+			continue
+
+		item = results.get()
+		if item is None:
+			alive -= 1
+			continue
+
+		job, response, error, where, elapsed = item
+		files = None
+		if error is None:
+			status = struct.unpack(">I", response[0:4])[0]
+			if status:
+				error = "Compile failed on %s:\n%s" % (where, response[4:])
+			else:
+				files = ibcache.UnpackFiles(response[4:])
+				if cache:
+					cache.store(job.key, files)
+		finish(job.inpath, job.outpath, job.kind, files, error, "%s, %.2fs" % (where, elapsed))
+		done += 1
+
+	for t in threads:
+		jobs.put(None)
+	for t in threads:
+		t.join()
+
+	print "%d compiled, %d failed." % (len(work) - len(failures), len(failures))
+	if cache:
+		print "Compile cache: " + cache.stats()
+	return failures
@@ -0,0 +1,24 @@
+import struct
+
+''' Message framing shared by the daemon (ibdaemon) and the compile farm (ibfarm).
+
+Every message is a 4 byte big-endian length followed by the payload.
+'''
+
+def SendMessage(sock, payload):
+	sock.sendall(struct.pack(">I", len(payload)) + payload)
+
+def _recvExactly(sock, length):
+	chunks = []
+	while length:
+		chunk = sock.recv(min(length, 1 << 16))
+		if not chunk:
+			raise EOFError("Connection closed mid-message.")
+		chunks.append(chunk)
+		length -= len(chunk)
+	return ''.join(chunks)
+
+# Raises EOFError if the connection closes before a whole message arrives.
+def RecvMessage(sock):
+	length = struct.unpack(">I", _recvExactly(sock, 4))[0]
+	return _recvExactly(sock, length)
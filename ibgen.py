@@ -1,36 +1,245 @@
 #!/usr/bin/python
 
-import os
 import sys
-import struct
+import getopt
 
-from genlib import *
+''' Generates synthetic XIBs and storyboards of any size, e.g. for benchmarks.
+Documents only use elements and attributes xibparser understands, and are
+the same for the same parameters.
+'''
 
+USAGE = '''Usage: ibgen.py [OPTIONS] xib|storyboard
+  --scenes <n>       view controller scenes in a storyboard (default: 3)
+  --depth <n>        levels of nested views below each root view (default: 2)
+  --subviews <n>     subviews of each view above the deepest level (default: 3)
+  --constraints <n>  layout constraints on each view with subviews (default: 2)
+  --cells <n>        prototype cells in each table view; every third scene
+                     is a table view controller if this isn't 0 (default: 0)
+  --segues <n>       buttons per scene with a show segue to another scene (default: 1)
+  --outlets <n>      outlets from the view controller (or file's owner) to its views (default: 2)
+  --out <path>       write the document to path instead of stdout'''
 
+DEFAULTS = {
+	'scenes' : 3,
+	'depth' : 2,
+	'subviews' : 3,
+	'constraints' : 2,
+	'cells' : 0,
+	'segues' : 1,
+	'outlets' : 2,
+}
 
+_LEAVES = [ 'label', 'button', 'view' ]
 
-view = NibObject('UIView')
-viewController = NibObject('UINavigationController')
+class _Generator(object):
+	def __init__(self, params):
+		self.params = dict(DEFAULTS, **params)
+		self.serial = 0
+		self.lines = [ ]
 
-viewController['UIView'] = view
+	def makeid(self, prefix):
+		self.serial += 1
+		return "%s-%02d-%03d" % (prefix, self.serial / 1000, self.serial % 1000)
 
-root = NibObject('NSObject')
-firstResponder = NibObject('UIProxyObject')
-firstResponder['UIProxiedObjectIdentifier'] = "IBFirstResponder"
-filesOwner = NibObject('UIProxyObject')
-filesOwner['UIProxiedObjectIdentifier'] = "IBFilesOwner"
-root['UINibTopLevelObjectsKey'] = [ filesOwner, firstResponder, viewController ]
-root['UINibObjectsKey'] = [ firstResponder, filesOwner, viewController ]
-root['UINibConnectionsKey'] = [ ]
-root['UINibVisibleWindowsKey'] = []
-root['UINibAccessibilityConfigurationsKey'] = [ ]
-root['UINibTraitStorageListsKey'] = [ ]
-root['UINibKeyValuePairsKey'] = [ ]
+	def add(self, indent, line):
+		self.lines.append("    " * indent + line)
 
+	# Writes a view holding `depth` more levels of subviews, and returns the
+	# ids of all views written. segues is the list of scene ids the first
+	# buttons segue to.
+	def view(self, indent, tag, depth, key = None, segues = None, index = 0):
+		viewid = self.makeid("vw")
+		ids = [ viewid ]
+		attributes = ' key="%s"' % (key) if key else ''
+		if tag == 'label':
+			attributes += ' opaque="NO" text="Label %d"' % (self.serial)
+		elif tag == 'button':
+			attributes += ' opaque="NO" buttonType="roundedRect"'
+		self.add(indent, '<%s%s contentMode="scaleToFill" translatesAutoresizingMaskIntoConstraints="NO" id="%s">' % (tag, attributes, viewid))
+		self.add(indent + 1, '<rect key="frame" x="%d" y="%d" width="100" height="30"/>' % (index * 10, index * 40))
+		if tag == 'label':
+			self.add(indent + 1, '<fontDescription key="fontDescription" type="system" pointSize="17"/>')
+			self.add(indent + 1, '<color key="textColor" red="0.2" green="0.3" blue="0.4" alpha="1" colorSpace="calibratedRGB"/>')
+		elif tag == 'button':
+			self.add(indent + 1, '<state key="normal" title="Button %d"/>' % (self.serial))
+			if segues:
+				self.add(indent + 1, '<connections>')
+				self.add(indent + 2, '<segue destination="%s" kind="show" id="%s"/>' % (segues.pop(0), self.makeid("sg")))
+				self.add(indent + 1, '</connections>')
 
+		subviewids = [ ]
+		if depth > 0 and self.params['subviews'] > 0:
+			self.add(indent + 1, '<subviews>')
+			for i in range(0, self.params['subviews']):
+				# Buttons first, so segues get used up at the top of the tree.
+				subtag = 'view' if depth > 1 and i > 0 else _LEAVES[(i + 1) % len(_LEAVES)]
+				subids = self.view(indent + 2, subtag, depth - 1 if subtag == 'view' else 0, segues = segues, index = i)
+				subviewids.append(subids[0])
+				ids.extend(subids)
+			self.add(indent + 1, '</subviews>')
+		if tag == 'view':
+			self.add(indent + 1, '<color key="backgroundColor" white="1" alpha="1" colorSpace="calibratedWhite"/>')
 
+		if subviewids and self.params['constraints'] > 0:
+			self.add(indent + 1, '<constraints>')
+			attributes = [ 'top', 'leading', 'bottom', 'trailing' ]
+			for i in range(0, self.params['constraints']):
+				attribute = attributes[i % len(attributes)]
+				self.add(indent + 2, '<constraint firstItem="%s" firstAttribute="%s" secondItem="%s" secondAttribute="%s" constant="%d" id="%s"/>'
+					% (subviewids[i % len(subviewids)], attribute, viewid, attribute, 8 + i, self.makeid("cn")))
+			self.add(indent + 1, '</constraints>')
+		self.add(indent, '</%s>' % (tag))
+		return ids
 
+	def outlets(self, indent, viewids):
+		count = min(self.params['outlets'], len(viewids))
+		if not count:
+			return
+		self.add(indent, '<connections>')
+		for i in range(0, count):
+			self.add(indent + 1, '<outlet property="outlet%d" destination="%s" id="%s"/>' % (i, viewids[i], self.makeid("ot")))
+		self.add(indent, '</connections>')
 
+	def xib(self):
+		# The file's owner comes first but has outlets to the views, so the
+		# views are generated before it and added after it.
+		lines = self.lines
+		self.lines = [ ]
+		viewids = self.view(2, 'view', self.params['depth'])
+		viewlines = self.lines
+		self.lines = lines
 
-CompileNibObjects([root])
+		self.add(0, '<?xml version="1.0" encoding="UTF-8" standalone="no"?>')
+		self.add(0, '<document type="com.apple.InterfaceBuilder3.CocoaTouch.XIB" version="3.0" toolsVersion="6254" targetRuntime="iOS.CocoaTouch" useAutolayout="YES">')
+		self.add(1, '<objects>')
+		self.add(2, '<placeholder placeholderIdentifier="IBFilesOwner" id="-1">')
+		self.outlets(3, viewids[1:])
+		self.add(2, '</placeholder>')
+		self.add(2, '<placeholder placeholderIdentifier="IBFirstResponder" id="-2"/>')
+		self.lines.extend(viewlines)
+		self.add(1, '</objects>')
+		self.add(0, '</document>')
+		return '\n'.join(self.lines) + '\n'
 
+	def sceneids(self):
+		return [ "vc-%03d" % (i) for i in range(0, self.params['scenes']) ]
+
+	def storyboard(self):
+		scenes = self.sceneids()
+		self.add(0, '<?xml version="1.0" encoding="UTF-8" standalone="no"?>')
+		self.add(0, '<document type="com.apple.InterfaceBuilder3.CocoaTouch.Storyboard.XIB" version="3.0" toolsVersion="6254" targetRuntime="iOS.CocoaTouch" useAutolayout="YES" initialViewController="nav-000">')
+		self.add(1, '<scenes>')
+
+		self.add(2, '<scene sceneID="%s">' % (self.makeid("sc")))
+		self.add(3, '<objects>')
+		self.add(4, '<navigationController id="nav-000" sceneMemberID="viewController">')
+		self.add(5, '<navigationBar key="navigationBar" contentMode="scaleToFill" id="%s">' % (self.makeid("nb")))
+		self.add(6, '<rect key="frame" x="0.0" y="0.0" width="320" height="44"/>')
+		self.add(6, '<autoresizingMask key="autoresizingMask"/>')
+		self.add(5, '</navigationBar>')
+		if scenes:
+			self.add(5, '<connections>')
+			self.add(6, '<segue destination="%s" kind="relationship" relationship="rootViewController" id="%s"/>' % (scenes[0], self.makeid("rl")))
+			self.add(5, '</connections>')
+		self.add(4, '</navigationController>')
+		self.add(4, '<placeholder placeholderIdentifier="IBFirstResponder" id="%s" sceneMemberID="firstResponder"/>' % (self.makeid("fr")))
+		self.add(3, '</objects>')
+		self.add(2, '</scene>')
+
+		for index, sceneid in enumerate(scenes):
+			others = [ s for s in scenes if s != sceneid ]
+			segues = [ others[i % len(others)] for i in range(0, self.params['segues']) ] if others else [ ]
+			self.add(2, '<scene sceneID="%s">' % (self.makeid("sc")))
+			self.add(3, '<objects>')
+			if self.params['cells'] and index % 3 == 2:
+				self.tableScene(4, sceneid, segues)
+			else:
+				self.viewScene(4, sceneid, segues)
+			self.add(4, '<placeholder placeholderIdentifier="IBFirstResponder" id="%s" sceneMemberID="firstResponder"/>' % (self.makeid("fr")))
+			self.add(3, '</objects>')
+			self.add(2, '</scene>')
+
+		self.add(1, '</scenes>')
+		self.add(0, '</document>')
+		return '\n'.join(self.lines) + '\n'
+
+	def viewScene(self, indent, sceneid, segues):
+		self.add(indent, '<viewController storyboardIdentifier="Scene%s" id="%s" sceneMemberID="viewController">' % (sceneid[3:], sceneid))
+		self.add(indent + 1, '<layoutGuides>')
+		self.add(indent + 2, '<viewControllerLayoutGuide type="top" id="%s"/>' % (self.makeid("tg")))
+		self.add(indent + 2, '<viewControllerLayoutGuide type="bottom" id="%s"/>' % (self.makeid("bg")))
+		self.add(indent + 1, '</layoutGuides>')
+		viewids = self.view(indent + 1, 'view', self.params['depth'], key = 'view', segues = segues)
+		self.add(indent + 1, '<navigationItem key="navigationItem" title="%s" id="%s"/>' % (sceneid, self.makeid("ni")))
+		self.outlets(indent + 1, viewids[1:])
+		self.add(indent, '</viewController>')
+
+	def tableScene(self, indent, sceneid, segues):
+		self.add(indent, '<tableViewController id="%s" sceneMemberID="viewController">' % (sceneid))
+		tableid = self.makeid("tv")
+		self.add(indent + 1, '<tableView key="view" clipsSubviews="YES" contentMode="scaleToFill" alwaysBounceVertical="YES" dataMode="prototypes" style="plain" separatorStyle="default" rowHeight="44" sectionHeaderHeight="22" sectionFooterHeight="22" id="%s">' % (tableid))
+		self.add(indent + 2, '<rect key="frame" x="0.0" y="0.0" width="600" height="600"/>')
+		self.add(indent + 2, '<autoresizingMask key="autoresizingMask" widthSizable="YES" heightSizable="YES"/>')
+		self.add(indent + 2, '<prototypes>')
+		for i in range(0, self.params['cells']):
+			cellid = self.makeid("cl")
+			labelid = self.makeid("lb")
+			self.add(indent + 3, '<tableViewCell contentMode="scaleToFill" selectionStyle="default" indentationWidth="10" reuseIdentifier="Cell%d" textLabel="%s" style="IBUITableViewCellStyleDefault" id="%s">' % (i, labelid, cellid))
+			self.add(indent + 4, '<rect key="frame" x="0.0" y="%d" width="600" height="44"/>' % (i * 44))
+			self.add(indent + 4, '<autoresizingMask key="autoresizingMask"/>')
+			self.add(indent + 4, '<tableViewCellContentView key="contentView" opaque="NO" clipsSubviews="YES" multipleTouchEnabled="YES" contentMode="center" tableViewCell="%s" id="%s">' % (cellid, self.makeid("cv")))
+			self.add(indent + 5, '<rect key="frame" x="0.0" y="0.0" width="600" height="43"/>')
+			self.add(indent + 5, '<autoresizingMask key="autoresizingMask"/>')
+			self.add(indent + 5, '<subviews>')
+			self.add(indent + 6, '<label opaque="NO" text="Row %d" id="%s">' % (i, labelid))
+			self.add(indent + 7, '<rect key="frame" x="15" y="0.0" width="570" height="43"/>')
+			self.add(indent + 7, '<autoresizingMask key="autoresizingMask"/>')
+			self.add(indent + 6, '</label>')
+			self.add(indent + 5, '</subviews>')
+			self.add(indent + 4, '</tableViewCellContentView>')
+			if segues:
+				self.add(indent + 4, '<connections>')
+				self.add(indent + 5, '<segue destination="%s" kind="show" id="%s"/>' % (segues.pop(0), self.makeid("sg")))
+				self.add(indent + 4, '</connections>')
+			self.add(indent + 3, '</tableViewCell>')
+		self.add(indent + 2, '</prototypes>')
+		self.add(indent + 2, '<connections>')
+		self.add(indent + 3, '<outlet property="dataSource" destination="%s" id="%s"/>' % (sceneid, self.makeid("ds")))
+		self.add(indent + 3, '<outlet property="delegate" destination="%s" id="%s"/>' % (sceneid, self.makeid("dl")))
+		self.add(indent + 2, '</connections>')
+		self.add(indent + 1, '</tableView>')
+		self.add(indent, '</tableViewController>')
+
+# Returns a XIB document with a root view of the given depth (see DEFAULTS
+# for the parameters), whose file's owner has outlets to its subviews.
+def GenerateXIB(**params):
+	return _Generator(params).xib()
+
+# Returns a storyboard document with a navigation controller scene, whose
+# root view controller is the first of params['scenes'] scenes.
+def GenerateStoryboard(**params):
+	return _Generator(params).storyboard()
+
+def main(argv = None):
+	ops, args = getopt.gnu_getopt(argv if argv is not None else sys.argv[1:], '', [ name + '=' for name in DEFAULTS.keys() ] + [ 'out=' ])
+	if len(args) != 1 or args[0] not in [ 'xib', 'storyboard' ]:
+		print USAGE
+		sys.exit(1)
+
+	params = { }
+	outpath = None
+	for option, value in ops:
+		if option == '--out':
+			outpath = value
+		else:
+			params[option[2:]] = int(value)
+
+	document = GenerateXIB(**params) if args[0] == 'xib' else GenerateStoryboard(**params)
+	if outpath:
+		with open(outpath, 'w') as fl:
+			fl.write(document)
+	else:
+		sys.stdout.write(document)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,380 @@
+import time
+import threading
+import contextlib
+import collections
+
+''' Compile hooks, and the profilers behind --profile and --memory-report.
+
+The compiler marks the phases of a compile with Phase(name, label) blocks
+and reports counts with Count(name, n). Both do nothing unless a hook is
+installed on the current thread with CompileHook(hook). A hook is any
+object with these methods:
+
+  enter(phase, label)   a phase starts; label is None or e.g. the XML tag
+  exit(phase, label)    the innermost phase that was entered ends
+  count(name, n)        n more of something (e.g. 'objects') were encoded
+
+The phases are:
+
+  compile             the whole compile (only marked by ibtool --profile)
+  parse               parsing the XML into an ElementTree
+  handler             a _xibparser_parse_* handler, labelled by its XML tag
+  resolveConnections  ArchiveContext.resolveConnections
+  addObjects          CompilationContext.addObjects, building the object list
+  makeTuples          CompilationContext.makeTuples
+  WriteNib            nibencoding.WriteNib
+  verify              nibverify.VerifyNib, with --verify
+  write               writing output files, or waiting for the writer threads
+  scene               a storyboard scene, labelled by its sceneID
+
+and the counts are 'nibs', 'objects', 'keys', 'values', 'classes' and
+'bytes' of every nib encoded. Phases nest, e.g. handlers in handlers and
+WriteNib in scenes.
+'''
+
+PHASES = [ 'compile', 'parse', 'handler', 'resolveConnections', 'addObjects', 'makeTuples', 'WriteNib', 'verify', 'write', 'scene' ]
+
+COUNTS = [ 'nibs', 'objects', 'keys', 'values', 'classes', 'bytes' ]
+
+_hooks = threading.local()
+
+# Returns the hook installed on this thread, or None.
+def CurrentHook():
+	return getattr(_hooks, 'hook', None)
+
+# Within the block, hook is told about the phases of every compile on this
+# thread. None removes the current hook.
+@contextlib.contextmanager
+def CompileHook(hook):
+	previous = CurrentHook()
+	_hooks.hook = hook
+	try:
+		yield hook
+	finally:
+		_hooks.hook = previous
+
+# Marks the block as a phase of the compile.
+@contextlib.contextmanager
+def Phase(name, label = None):
+	hook = getattr(_hooks, 'hook', None)
+	if hook is None:
+		yield
+		return
+	hook.enter(name, label)
+	try:
+		yield
+	finally:
+		hook.exit(name, label)
+
+def Count(name, n = 1):
+	hook = getattr(_hooks, 'hook', None)
+	if hook is not None:
+		hook.count(name, n)
+
+class Profiler(object):
+	''' A compile hook that records the wall and CPU time of each phase.
+
+	A phase's time includes the phases nested in it, but recursive phases
+	(handlers of views in views) are only timed at the outermost level, so
+	every time is the time actually spent in the phase. For labelled phases,
+	the self time excludes all nested phases.
+
+	CPU time is time.clock(), the CPU time of the whole process. It includes
+	other threads, such as the AsyncSinkWriter threads writing the nibs of
+	earlier scenes, so a phase's CPU time can exceed its wall time.
+	'''
+
+	def __init__(self):
+		self.phases = { }	# phase -> [ calls, wall, cpu ]
+		self.labels = { }	# (phase, label) -> [ calls, wall, cpu, self wall ]
+		self.counts = collections.Counter()
+		self.sceneCounts = { }	# scene label -> Counter of the counts in the scene
+		self._stack = [ ]
+		self._active = collections.Counter()	# phases and (phase, label)s on the stack
+
+	def enter(self, phase, label):
+		self._active[phase] += 1
+		self._active[(phase, label)] += 1
+		self._stack.append([ phase, label, time.time(), time.clock(), 0.0 ])
+
+	def exit(self, phase, label):
+		phase, label, wallstart, cpustart, nested = self._stack.pop()
+		wall = time.time() - wallstart
+		cpu = time.clock() - cpustart
+		if self._stack:
+			self._stack[-1][4] += wall
+
+		self._active[phase] -= 1
+		stats = self.phases.setdefault(phase, [ 0, 0.0, 0.0 ])
+		stats[0] += 1
+		if not self._active[phase]:
+			stats[1] += wall
+			stats[2] += cpu
+
+		self._active[(phase, label)] -= 1
+		if label is not None:
+			stats = self.labels.setdefault((phase, label), [ 0, 0.0, 0.0, 0.0 ])
+			stats[0] += 1
+			stats[3] += wall - nested
+			if not self._active[(phase, label)]:
+				stats[1] += wall
+				stats[2] += cpu
+
+	def count(self, name, n):
+		self.counts[name] += n
+		for phase, label, wallstart, cpustart, nested in reversed(self._stack):
+			if phase == 'scene':
+				self.sceneCounts.setdefault(label, collections.Counter())[name] += n
+				break
+
+	# Returns (label, [ calls, wall, cpu, self wall ]) for each label of
+	# phase, slowest first.
+	def labelled(self, phase):
+		rows = [ (label, stats) for (p, label), stats in self.labels.items() if p == phase ]
+		rows.sort(key = lambda row: -row[1][1])
+		return rows
+
+def _jsonProfile(profiler):
+	ms = lambda seconds: round(seconds * 1000, 3)
+	return {
+		'phases' : [ { 'phase' : phase, 'calls' : calls, 'wall_ms' : ms(wall), 'cpu_ms' : ms(cpu) }
+			for phase in PHASES if phase in profiler.phases for calls, wall, cpu in [ profiler.phases[phase] ] ],
+		'handlers' : [ { 'tag' : tag, 'calls' : calls, 'cumulative_ms' : ms(wall), 'cpu_ms' : ms(cpu), 'self_ms' : ms(selfwall) }
+			for tag, (calls, wall, cpu, selfwall) in profiler.labelled('handler') ],
+		'scenes' : [ dict(profiler.sceneCounts.get(scene, { }), scene = scene, wall_ms = ms(wall), cpu_ms = ms(cpu))
+			for scene, (calls, wall, cpu, selfwall) in profiler.labelled('scene') ],
+		'counts' : dict(profiler.counts),
+	}
+
+# Returns the profile as a JSON document.
+def FormatProfileJSON(profiler):
+	import json
+	return json.dumps(_jsonProfile(profiler), indent = 1, sort_keys = True)
+
+# Returns the profile as text: the time of each phase, the top handlers by
+# cumulative time, the slowest scenes and the counts.
+def FormatProfile(profiler, top = 20):
+	lines = [ ]
+	lines.append("%-24s %8s %11s %11s" % ("phase", "calls", "wall (ms)", "cpu (ms)"))
+	for phase in PHASES:
+		if phase in profiler.phases:
+			calls, wall, cpu = profiler.phases[phase]
+			lines.append("%-24s %8d %11.1f %11.1f" % (phase, calls, wall * 1000, cpu * 1000))
+
+	handlers = profiler.labelled('handler')
+	if handlers:
+		lines.append("")
+		lines.append("%-24s %8s %11s %11s" % ("handler", "calls", "cum (ms)", "self (ms)"))
+		for tag, (calls, wall, cpu, selfwall) in handlers[0 : top]:
+			lines.append("%-24s %8d %11.1f %11.1f" % (tag, calls, wall * 1000, selfwall * 1000))
+
+	scenes = profiler.labelled('scene')
+	if scenes:
+		lines.append("")
+		lines.append("%-24s %11s %11s %8s %8s %8s" % ("scene", "wall (ms)", "cpu (ms)", "nibs", "objects", "values"))
+		for scene, (calls, wall, cpu, selfwall) in scenes[0 : top]:
+			counts = profiler.sceneCounts.get(scene, { })
+			lines.append("%-24s %11.1f %11.1f %8d %8d %8d" % (scene, wall * 1000, cpu * 1000,
+				counts.get('nibs', 0), counts.get('objects', 0), counts.get('values', 0)))
+
+	lines.append("")
+	lines.append(", ".join("%d %s" % (profiler.counts[name], name) for name in COUNTS))
+	return '\n'.join(lines)
+
+def _rssMeter():
+	import os
+	import sys
+	import resource
+	pagesize = os.sysconf('SC_PAGE_SIZE')
+	# ru_maxrss is in kilobytes on Linux and in bytes on OS X.
+	scale = 1 if sys.platform == 'darwin' else 1024
+	def measure():
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+		try:
+			with open('/proc/self/statm') as fl:
+				current = int(fl.read().split()[1]) * pagesize
+		except (IOError, OSError):
+			current = peak
+		return current, peak
+	return measure
+
+class MemoryProfiler(object):
+	''' A compile hook that records the memory use of each phase.
+
+	Memory is measured with tracemalloc where it exists (Python 3.4+), which
+	counts the bytes Python has allocated, and otherwise from the process's
+	resident set size, which also counts freed memory the allocator keeps. For
+	each phase, the peak is the most memory in use at any point during it and
+	the growth is how much higher that was than at its start. The retained
+	memory is how much more was in use when it ended than when it started,
+	e.g. the ElementTree after parse or the object graphs the scenes keep
+	until their nibs are written. Handlers are not measured separately.
+
+	When the first phase ends, the live NibObjects are counted by class and,
+	with tracemalloc, the top allocation sites are taken from a snapshot.
+	Both cost time, so rather than at every phase boundary, this census is
+	only taken again when a phase ends with at least 10% more memory in use
+	than at the last one.
+	'''
+
+	def __init__(self, frames = 1):
+		self.phases = { }	# phase -> [ calls, peak, retained, growth ]
+		self.labels = { }	# (phase, label) -> [ calls, peak, retained, growth ]
+		self.census = None	# { 'phase', 'label', 'bytes', 'classes', 'sites' } at the highest boundary
+		self._stack = [ ]
+		self._started = False
+		try:
+			import tracemalloc
+		except ImportError:
+			tracemalloc = None
+		self._tracemalloc = tracemalloc
+		if tracemalloc is not None:
+			if not tracemalloc.is_tracing():
+				tracemalloc.start(frames)
+				self._started = True
+			self.meter = 'tracemalloc'
+			self._measure = tracemalloc.get_traced_memory
+		else:
+			self.meter = 'rss'
+			self._measure = _rssMeter()
+		self.start, self._lastpeak = self._measure()
+		self.peak = self.start
+		if hasattr(self._tracemalloc, 'reset_peak'):
+			self._tracemalloc.reset_peak()
+
+	# Stops tracemalloc if the profiler started it.
+	def close(self):
+		if self._started:
+			self._tracemalloc.stop()
+			self._started = False
+
+	# Returns the memory in use now and the most in use since the previous call.
+	def _sample(self):
+		current, peak = self._measure()
+		if hasattr(self._tracemalloc, 'reset_peak'):
+			self._tracemalloc.reset_peak()
+			since = peak
+		else:
+			since = peak if peak > self._lastpeak else current
+			self._lastpeak = peak
+		self.peak = max(self.peak, since)
+		return current, since
+
+	def enter(self, phase, label):
+		if phase == 'handler':
+			return
+		current, since = self._sample()
+		if self._stack:
+			self._stack[-1][3] = max(self._stack[-1][3], since)
+		self._stack.append([ phase, label, current, current ])
+
+	def exit(self, phase, label):
+		if phase == 'handler':
+			return
+		current, since = self._sample()
+		phase, label, start, peak = self._stack.pop()
+		peak = max(peak, since, current)
+		if self._stack:
+			self._stack[-1][3] = max(self._stack[-1][3], peak)
+
+		for table, key in [ (self.phases, phase), (self.labels, (phase, label)) ]:
+			if table is self.labels and label is None:
+				continue
+			stats = table.setdefault(key, [ 0, 0, 0, 0 ])
+			stats[0] += 1
+			stats[1] = max(stats[1], peak)
+			stats[2] += current - start
+			stats[3] = max(stats[3], peak - start)
+
+		if self.census is None or current > self.census['bytes'] * 1.1:
+			scenes = [ frame[1] for frame in self._stack if frame[0] == 'scene' ]
+			self.census = self._census(phase, label or (scenes and scenes[-1]) or None, current)
+
+	def count(self, name, n):
+		pass
+
+	def _census(self, phase, label, current, top = 20):
+		import gc
+		import genlib
+		classes = collections.Counter()
+		for obj in gc.get_objects():
+			if isinstance(obj, genlib.NibObject):
+				classes[obj.classname()] += 1
+		sites = [ ]
+		if self._tracemalloc is not None:
+			tracemalloc = self._tracemalloc
+			snapshot = tracemalloc.take_snapshot().filter_traces([
+				tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '*/ibprofile.py') ])
+			for stat in snapshot.statistics('lineno')[0 : top]:
+				frame = stat.traceback[0]
+				sites.append({ 'file' : frame.filename, 'line' : frame.lineno, 'bytes' : stat.size, 'count' : stat.count })
+		return { 'phase' : phase, 'label' : label, 'bytes' : current, 'classes' : classes, 'sites' : sites }
+
+	# Returns (label, [ calls, peak, retained, growth ]) for each label of
+	# phase, the one whose memory use grew most first.
+	def labelled(self, phase):
+		rows = [ (label, stats) for (p, label), stats in self.labels.items() if p == phase ]
+		rows.sort(key = lambda row: -row[1][3])
+		return rows
+
+def _jsonMemoryReport(profiler):
+	census = profiler.census or { 'phase' : None, 'label' : None, 'bytes' : 0, 'classes' : { }, 'sites' : [ ] }
+	return {
+		'meter' : profiler.meter,
+		'start_bytes' : profiler.start,
+		'peak_bytes' : profiler.peak,
+		'phases' : [ { 'phase' : phase, 'calls' : calls, 'peak_bytes' : peak, 'retained_bytes' : retained, 'growth_bytes' : growth }
+			for phase in PHASES if phase in profiler.phases for calls, peak, retained, growth in [ profiler.phases[phase] ] ],
+		'scenes' : [ { 'scene' : scene, 'peak_bytes' : peak, 'retained_bytes' : retained, 'growth_bytes' : growth }
+			for scene, (calls, peak, retained, growth) in profiler.labelled('scene') ],
+		'census' : {
+			'phase' : census['phase'],
+			'label' : census['label'],
+			'bytes' : census['bytes'],
+			'nibobjects' : dict(census['classes']),
+			'sites' : census['sites'],
+		},
+	}
+
+# Returns the memory report as a JSON document.
+def FormatMemoryReportJSON(profiler):
+	import json
+	return json.dumps(_jsonMemoryReport(profiler), indent = 1, sort_keys = True)
+
+# Returns the memory report as text: the peak and retained memory of each
+# phase and of the scenes with the highest peaks, the top allocation sites
+# and the live NibObjects by class when memory use was highest.
+def FormatMemoryReport(profiler, top = 20):
+	kb = lambda size: size / 1024.0
+	lines = [ ]
+	lines.append("Memory measured with %s, in KB; %.0f in use before the compile, %.0f at the peak"
+		% (profiler.meter if profiler.meter == 'tracemalloc' else 'the resident set size (tracemalloc is unavailable)', kb(profiler.start), kb(profiler.peak)))
+	lines.append("")
+	lines.append("%-24s %8s %11s %11s %11s" % ("phase", "calls", "peak", "growth", "retained"))
+	for phase in PHASES:
+		if phase in profiler.phases:
+			calls, peak, retained, growth = profiler.phases[phase]
+			lines.append("%-24s %8d %11.0f %+11.0f %+11.0f" % (phase, calls, kb(peak), kb(growth), kb(retained)))
+
+	scenes = profiler.labelled('scene')
+	if scenes:
+		lines.append("")
+		lines.append("%-24s %8s %11s %11s %11s" % ("scene", "", "peak", "growth", "retained"))
+		for scene, (calls, peak, retained, growth) in scenes[0 : top]:
+			lines.append("%-24s %8s %11.0f %+11.0f %+11.0f" % (scene, "", kb(peak), kb(growth), kb(retained)))
+
+	census = profiler.census
+	if census:
+		where = census['phase'] + (" in scene " + census['label'] if census['label'] and census['phase'] != 'scene' else "")
+		if census['phase'] == 'scene':
+			where += " " + census['label']
+		if census['sites']:
+			lines.append("")
+			lines.append("Top allocation sites after %s (%.0f KB in use):" % (where, kb(census['bytes'])))
+			for site in census['sites'][0 : top]:
+				lines.append("%11.0f %8d  %s:%d" % (kb(site['bytes']), site['count'], site['file'], site['line']))
+		lines.append("")
+		lines.append("Live NibObjects by class after %s:" % (where))
+		for classname, count in census['classes'].most_common(top):
+			lines.append("%11d  %s" % (count, classname))
+	return '\n'.join(lines)
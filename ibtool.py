@@ -1,35 +1,75 @@
 #!/usr/bin/python
 
+import os
 import sys
-import xml.etree.ElementTree as ET
-import xibparser
-import genlib
 import getopt
-import ibdump
+import contextlib
+
+# The compile and dump machinery is imported by the functions that need it,
+# so e.g. --dump doesn't pay for importing ElementTree and the XIB parser.
 
 class IBCommands(object):
 	Compile = 0
 	Dump = 1
+	Watch = 2
+	Patch = 3
+	Inspect = 4
+	Diff = 5
+	SizeReport = 6
+
+IB_SHORT_OPTIONS = 'e'
+IB_LONG_OPTIONS = ['compile=', 'write=', 'dump', 'plist-format=', 'jobs=', 'daemon=', 'connect=', 'cache-dir=', 'cache-size=',
+	'depfile=', 'output-manifest=', 'manifest-only', 'watch=', 'out=', 'worker=', 'workers=', 'local-workers=', 'patch=', 'format=', 'inspect', 'max-depth=', 'diff',
+	'size-report', 'verify', 'profile', 'memory-report']
+IB_PATH_OPTIONS = ['--compile', '--write', '--cache-dir', '--depfile', '--output-manifest', '--watch', '--out', '--patch']
+
+def main(argv = None):
 
-def main():
+	if argv is None:
+		argv = sys.argv[1:]
 
-	ops, args = getopt.getopt(sys.argv[1:], 'e', ['compile=', 'write=', 'dump'])
+	ops, args = getopt.getopt(argv, IB_SHORT_OPTIONS, IB_LONG_OPTIONS)
 
 	# print ops
 	# print args
 
-	if len(args) == 0:
+	for option, value in ops:
+		if option == '--daemon':
+			import ibdaemon
+			ibdaemon.RunDaemon(value)
+			return
+		elif option == '--connect':
+			import ibdaemon
+			forwarded = [ a for o, v in ops if o != '--connect' for a in ([o, v] if v else [o]) ]
+			sys.exit(ibdaemon.RunClient(forwarded + ['--'] + args, value))
+		elif option == '--worker':
+			import ibfarm
+			ibfarm.RunWorker(value)
+			return
+
+	opts = dict(ops)
+	if '--watch' not in opts and len(args) == 0:
 		print "Error: No input file given."
 		sys.exit(1)
-	elif len(args) > 1:
-		print "Error: ibtool currently only supports one input file."
-		sys.exit(1)
 
 	command = IBCommands.Dump
-	inpath = args[0] 
+	inpath = args[0] if args else None
 
 	_write = None
 	_compile = None
+	_plistformat = None
+	_jobs = None
+	_cachedir = None
+	_cachesize = None
+	_depfile = None
+	_manifest = None
+	_manifestonly = False
+	_workers = None
+	_localworkers = 0
+	_format = None
+	_maxdepth = None
+	_verify = False
+	_profile = None
 	shortflags = []
 
 	for option, value in ops:
@@ -40,6 +80,53 @@ def main():
 			_write = value
 		elif option == '--dump':
 			command = IBCommands.Dump
+		elif option == '--plist-format':
+			if value not in ['binary', 'xml']:
+				print "Error: --plist-format must be 'binary' or 'xml'."
+				sys.exit(1)
+			_plistformat = value
+		elif option == '--jobs':
+			_jobs = int(value)
+		elif option == '--cache-dir':
+			_cachedir = value
+		elif option == '--cache-size':
+			import ibcache
+			_cachesize = ibcache.ParseSize(value)
+		elif option == '--depfile':
+			_depfile = value
+		elif option == '--output-manifest':
+			_manifest = value
+		elif option == '--manifest-only':
+			_manifestonly = True
+		elif option == '--workers':
+			import ibfarm
+			_workers = [ ibfarm.ParseAddress(a) for a in value.split(',') if a ]
+		elif option == '--local-workers':
+			_localworkers = int(value)
+		elif option == '--watch':
+			command = IBCommands.Watch
+		elif option == '--patch':
+			command = IBCommands.Patch
+		elif option == '--max-depth':
+			_maxdepth = int(value)
+		elif option == '--diff':
+			command = IBCommands.Diff
+		elif option == '--inspect':
+			command = IBCommands.Inspect
+		elif option == '--size-report':
+			command = IBCommands.SizeReport
+		elif option == '--verify':
+			_verify = True
+		elif option in ['--profile', '--memory-report']:
+			if _profile not in [ None, option[2:] ]:
+				print "Error: --profile and --memory-report can't be used together."
+				sys.exit(1)
+			_profile = option[2:]
+		elif option == '--format':
+			if value not in ['text', 'json', 'ndjson']:
+				print "Error: --format must be 'text', 'json' or 'ndjson'."
+				sys.exit(1)
+			_format = value
 		elif option == '-e':
 			shortflags.append('e')
 
@@ -47,13 +134,80 @@ def main():
 		print "Error: No command given."
 		sys.exit(1)
 
-	if command == IBCommands.Compile:
-		ib_compile(inpath, _write or _compile)
+	if command == IBCommands.Diff:
+		if len(args) != 2:
+			print "Error: --diff needs two nib files."
+			sys.exit(1)
+		sys.exit(1 if ib_diff(args[0], args[1]) else 0)
+
+	batch = len(args) > 1 or (inpath is not None and os.path.isdir(inpath))
+	if batch and command not in [ IBCommands.Compile, IBCommands.Patch, IBCommands.Inspect, IBCommands.SizeReport ]:
+		print "Error: Multiple input files are only supported with --compile, --patch, --inspect and --size-report."
+		sys.exit(1)
+
+	if command == IBCommands.Compile and (_depfile or _manifest or _manifestonly):
+		outpath = _write or _compile
+		pairs = ib_collect_batch_inputs(args, outpath) if batch else [ (inpath, outpath) ]
+		try:
+			ib_write_output_lists(pairs, _depfile, _manifest or ('-' if _manifestonly else None))
+		except Exception as e:
+			print "Error: Can't list the outputs of %s: %s" % (inpath, e)
+			sys.exit(1)
+		if _manifestonly:
+			return
+
+	cache = None
+	if _cachedir:
+		import ibcache
+		cache = ibcache.CompileCache(_cachedir, _cachesize)
+
+	if command == IBCommands.Watch:
+		if not opts.get('--out'):
+			print "Error: --watch needs an output directory given with --out."
+			sys.exit(1)
+		if _profile:
+			print "Error: --%s isn't supported with --watch." % (_profile)
+			sys.exit(1)
+		import ibwatch
+		ibwatch.Watch(opts['--watch'], opts['--out'], _plistformat, cache, verify = _verify)
+	elif command == IBCommands.Compile and (_workers or _localworkers) and _verify:
+		print "Error: --verify isn't supported when compiling on workers."
+		sys.exit(1)
+	elif command == IBCommands.Compile and _profile and (batch or _workers or _localworkers):
+		print "Error: --%s only supports compiling a single input in this process." % (_profile)
+		sys.exit(1)
+	elif command == IBCommands.Compile and (_workers or _localworkers):
+		failures = ib_compile_on_workers(args, _write or _compile, batch, _workers, _localworkers, _plistformat, cache)
+		sys.exit(1 if failures else 0)
+	elif command == IBCommands.Compile and batch:
+		failures = ib_compile_batch(args, _write or _compile, _plistformat, _jobs, cache, _verify)
+		sys.exit(1 if failures else 0)
+	elif command == IBCommands.Compile and _profile:
+		ib_compile_profiled(inpath, _write or _compile, _plistformat, cache, _verify, _format, _profile == 'memory-report')
+	elif command == IBCommands.Compile:
+		ib_compile(inpath, _write or _compile, _plistformat, cache, _verify)
+		if cache:
+			print "Compile cache: " + cache.stats()
+	elif command == IBCommands.Patch:
+		if batch and _write:
+			print "Error: --write can't be used when patching multiple nibs; they are patched in place."
+			sys.exit(1)
+		failures = ib_patch(args, _write, opts['--patch'])
+		sys.exit(1 if failures else 0)
+	elif command == IBCommands.Inspect:
+		failures = ib_inspect(args, _jobs, _format)
+		sys.exit(1 if failures else 0)
+	elif command == IBCommands.SizeReport:
+		failures = ib_size_report(args, _format)
+		sys.exit(1 if failures else 0)
 	elif command == IBCommands.Dump:
-		ib_dump(inpath, shortflags)
+		ib_dump(inpath, shortflags, _format, _maxdepth)
 
 
-def ib_compile(inpath, outpath):
+# With verify, every nib is decoded again after encoding and checked against
+# what was encoded (see genlib.VerifyingNibs); outputs taken from the cache
+# are not checked.
+def ib_compile(inpath, outpath, plistformat = None, cache = None, verify = False):
 	def die_if(condition, message):
 		if condition:
 			print message
@@ -61,35 +215,569 @@ def ib_compile(inpath, outpath):
 
 	die_if(not outpath, "ib_compile: No input path given")
 
-	suffix = None
+	suffix = ib_input_kind(inpath)
+	die_if(suffix is None, "ib_compile: Only .xib and .storyboard files are currently supported.")
+
+	import genlib
+	with genlib.VerifyingNibs(verify):
+		if outpath == '-':
+			# XIBs are written to stdout as a plain nib, storyboards as a tar stream.
+			import ibwriter
+			with _ib_prints_to_stderr() as stdout:
+				if suffix == 'xib':
+					ib_compile_xib(inpath, outpath, sink = ibwriter.StreamSink(stdout), cache = cache)
+				else:
+					with ibwriter.TarSink(stdout) as sink:
+						ib_compile_storyboard(inpath, outpath, plistformat, sink = sink, cache = cache)
+			return
+
+		if suffix == 'xib':
+			ib_compile_xib(inpath, outpath, cache = cache)
+		elif suffix == 'storyboard':
+			ib_compile_storyboard(inpath, outpath, plistformat, cache = cache)
+
+# Compiles like ib_compile with an ibprofile.Profiler hooked in, or with an
+# ibprofile.MemoryProfiler if memory is set, and prints the report to stderr
+# as a table, or as JSON if fmt is 'json'.
+def ib_compile_profiled(inpath, outpath, plistformat = None, cache = None, verify = False, fmt = None, memory = False):
+	import ibprofile
+	if memory:
+		profiler = ibprofile.MemoryProfiler()
+		formatters = ibprofile.FormatMemoryReport, ibprofile.FormatMemoryReportJSON
+	else:
+		profiler = ibprofile.Profiler()
+		formatters = ibprofile.FormatProfile, ibprofile.FormatProfileJSON
+	try:
+		with ibprofile.CompileHook(profiler):
+			with ibprofile.Phase('compile'):
+				ib_compile(inpath, outpath, plistformat, cache, verify)
+	finally:
+		if memory:
+			profiler.close()
+	report = formatters[1](profiler) if fmt == 'json' else formatters[0](profiler)
+	sys.stderr.write(report + '\n')
+
+# Returns the paths of the files ib_compile(inpath, outpath) will create.
+# Only the input's XML is read; no objects are parsed and no nibs are encoded.
+def ib_compile_outputs(inpath, outpath):
+	import ibwriter
+	if ib_input_kind(inpath) != 'storyboard' or ibwriter.SinkKindForPath(outpath) != 'directory':
+		return [ outpath ]
+
+	import xml.etree.ElementTree as ET
+	import xibparser
+	tree = ib_load_input(inpath, ET.parse)
+	return [ os.path.join(outpath, name) for name in xibparser.StoryboardOutputNames(tree) ]
+
+# Returns 'xib' or 'storyboard' for the input at inpath, going by its suffix,
+# or by its document type for stdin ('-'). Returns None for anything else.
+def ib_input_kind(inpath):
 	if inpath.endswith(".xib"):
-		suffix = "xib"
-	elif inpath.endswith(".storyboard"):
-		suffix = "storyboard"
+		return 'xib'
+	if inpath.endswith(".storyboard"):
+		return 'storyboard'
+	if inpath == '-':
+		return ib_document_kind(ib_read_input(inpath))
+	return None
 
-	die_if(suffix is None, "ib_compile: Only .xib and .storyboard files are currently supported.")
-	if suffix == 'xib':
-		ib_compile_xib(inpath, outpath)
-	elif suffix == 'storyboard':
-		ib_compile_storyboard(inpath, outpath)
-
-def ib_compile_xib(inpath, outpath):
-	tree = ET.parse(inpath)
-	root = tree.getroot()
-	objects = root.iter('objects').next()
-	nibroot = xibparser.ParseXIBObjects(objects)
-	outbytes = genlib.CompileNibObjects([nibroot])
-
-	with open(outpath, 'wb') as fl:
-		fl.write(outbytes)
-
-def ib_compile_storyboard(inpath, outpath):
-	tree = ET.parse(inpath)
-	xibparser.CompileStoryboard(tree, outpath)
-
-def ib_dump(inpath, shortflags):
+# Writes a make/ninja depfile and/or a manifest listing one output per line
+# for the given (input path, output path) pairs. A path of '-' means stdout.
+# The depfile has a rule for each output path, listing its implicit inputs:
+# the input document (unless it's stdin) and the compiler's source files.
+def ib_write_output_lists(pairs, depfile = None, manifest = None):
+	def escape(path):
+		return path.replace(' ', '\\ ').replace('#', '\\#').replace('$', '$$')
+
+	def writelines(path, lines):
+		if path == '-':
+			sys.stdout.write(''.join(lines))
+			return
+		with open(path, 'w') as fl:
+			fl.write(''.join(lines))
+
+	if depfile:
+		import ibcache
+		lines = [ ]
+		for inpath, outpath in pairs:
+			dependencies = ([ inpath ] if inpath != '-' else [ ]) + ibcache.CompilerSources()
+			lines.append("%s: %s\n" % (escape(outpath), ' '.join(escape(d) for d in dependencies)))
+		writelines(depfile, lines)
+
+	if manifest:
+		writelines(manifest, [ output + "\n" for inpath, outpath in pairs for output in ib_compile_outputs(inpath, outpath) ])
+
+# Returns a list of (input path, output path) tuples for the given files and
+# directories. Directories are walked for .xib and .storyboard files, and
+# outputs mirror the input tree below outdir. Files given directly are
+# compiled to their basename, so inputs that would end up at the same output
+# path (e.g. a/Main.xib and b/Main.xib) are an error.
+def ib_collect_batch_inputs(paths, outdir):
+	def outpathfor(relpath):
+		base, ext = os.path.splitext(relpath)
+		return os.path.join(outdir, base + (".nib" if ext == ".xib" else ".storyboardc"))
+
+	jobs = []
+	for path in paths:
+		if not os.path.isdir(path):
+			jobs.append((path, outpathfor(os.path.basename(path))))
+			continue
+		for dirpath, dirnames, filenames in os.walk(path):
+			dirnames.sort()
+			for filename in sorted(filenames):
+				if not (filename.endswith(".xib") or filename.endswith(".storyboard")):
+					continue
+				inpath = os.path.join(dirpath, filename)
+				jobs.append((inpath, outpathfor(os.path.relpath(inpath, path))))
+
+	inputs = { }
+	for inpath, outpath in jobs:
+		if outpath in inputs:
+			print "Error: %s and %s would both be compiled to %s." % (inputs[outpath], inpath, outpath)
+			sys.exit(1)
+		inputs[outpath] = inpath
+	return jobs
+
+# Compiles one batch job. Runs in a worker process, so errors are returned
+# rather than raised. options holds the keyword arguments for ib_compile.
+def _ib_compile_batch_job(job):
+	import time
+	import traceback
+	inpath, outpath, options = job
+	cache = options.get('cache')
+	cachestats = (cache.hits, cache.misses) if cache else (0, 0)
+	start = time.time()
+	try:
+		outdir = os.path.dirname(outpath)
+		if outdir and not os.path.isdir(outdir):
+			try:
+				os.makedirs(outdir)
+			except OSError:
+				pass # Another worker may have created it.
+		ib_compile(inpath, outpath, **options)
+		error = None
+	except SystemExit:
+		error = "ib_compile exited early."
+	except Exception:
+		error = traceback.format_exc()
+
+	# Worker processes have their own copy of the cache, so report this
+	# job's hits and misses back for the totals.
+	if cache:
+		cachestats = (cache.hits - cachestats[0], cache.misses - cachestats[1])
+	return (inpath, outpath, error, time.time() - start, cachestats)
+
+# Compiles many inputs into a mirrored output tree using a pool of jobs
+# worker processes. The largest inputs are scheduled first so they don't end
+# up running alone at the end. A failing file doesn't stop the batch.
+# Returns the list of (input path, error) tuples for the files that failed.
+def ib_compile_batch(paths, outdir, plistformat = None, jobs = None, cache = None, verify = False):
+	if not outdir:
+		print "ib_compile_batch: No output directory given"
+		sys.exit(1)
+
+	work = ib_collect_batch_inputs(paths, outdir)
+	work.sort(key = lambda job: os.path.getsize(job[0]) if os.path.isfile(job[0]) else 0, reverse = True)
+	options = { 'plistformat' : plistformat, 'cache' : cache, 'verify' : verify }
+	work = [ (inpath, outpath, options) for inpath, outpath in work ]
+
+	import multiprocessing
+	jobs = jobs or multiprocessing.cpu_count()
+	if jobs > 1 and len(work) > 1:
+		pool = multiprocessing.Pool(min(jobs, len(work)))
+		results = pool.imap_unordered(_ib_compile_batch_job, work)
+	else:
+		pool = None
+		results = (_ib_compile_batch_job(job) for job in work)
+
+	failures = []
+	hits = misses = 0
+	for inpath, outpath, error, elapsed, cachestats in results:
+		hits += cachestats[0]
+		misses += cachestats[1]
+		if error:
+			failures.append((inpath, error))
+			print "FAILED %s" % (inpath)
+			print error
+		else:
+			print "compiled %s -> %s (%.2fs)" % (inpath, outpath, elapsed)
+
+	if pool is not None:
+		pool.close()
+		pool.join()
+
+	print "%d compiled, %d failed." % (len(work) - len(failures), len(failures))
+	if cache:
+		print "Compile cache: %d hits, %d misses" % (hits, misses)
+	return failures
+
+# Like ib_compile_batch, but ships the inputs to compile workers over TCP
+# (see ibfarm): the workers at addresses, plus localworkers workers started
+# on this machine for the duration of the compile.
+def ib_compile_on_workers(paths, outpath, batch, addresses = None, localworkers = 0, plistformat = None, cache = None):
+	if not outpath or outpath == '-':
+		print "ib_compile_on_workers: Compiling on workers needs an output path."
+		sys.exit(1)
+
+	import ibfarm
+	work = ib_collect_batch_inputs(paths, outpath) if batch else [ (paths[0], outpath) ]
+	work.sort(key = lambda job: os.path.getsize(job[0]) if os.path.isfile(job[0]) else 0, reverse = True)
+
+	processes = [ ]
+	addresses = list(addresses or [ ])
+	if localworkers:
+		processes, local = ibfarm.StartLocalWorkers(localworkers)
+		addresses.extend(local)
+	try:
+		return ibfarm.CompileOnWorkers(work, addresses, plistformat, cache)
+	finally:
+		ibfarm.StopLocalWorkers(processes)
+
+# Cache of parsed inputs, used when ibtool runs as a resident daemon.
+_input_cache = None
+
+def ib_set_input_cache(cache):
+	global _input_cache
+	_input_cache = cache
+
+_stdin_bytes = None
+
+# Returns the contents of inpath, where '-' means stdin.
+def ib_read_input(inpath):
+	global _stdin_bytes
+	if inpath != '-':
+		with open(inpath, 'rb') as fl:
+			return fl.read()
+	if _stdin_bytes is None:
+		_stdin_bytes = sys.stdin.read()
+	return _stdin_bytes
+
+# Returns loader(inpath), going through the input cache if there is one.
+# For stdin ('-'), loader is given a file object instead of a path.
+def ib_load_input(inpath, loader):
+	if inpath == '-':
+		from cStringIO import StringIO
+		return loader(StringIO(ib_read_input(inpath)))
+	if _input_cache is None:
+		return loader(inpath)
+	return _input_cache.get(inpath, loader)
+
+# Returns 'xib' or 'storyboard' for the XML document in data, based on the
+# document's type attribute.
+def ib_document_kind(data):
+	import re
+	match = re.search(r'<document[^>]*\stype="([^"]*)"', data[0:4096])
+	if not match:
+		return None
+	return 'storyboard' if 'Storyboard' in match.group(1) else 'xib'
+
+# Sends prints to stderr while compiled output goes to stdout, and yields
+# the stream to write that output to.
+@contextlib.contextmanager
+def _ib_prints_to_stderr():
+	if hasattr(sys.stdout, 'redirected'):
+		# The daemon's per-request stdout.
+		with sys.stdout.redirected(sys.stderr) as stdout:
+			yield stdout
+		return
+
+	stdout = sys.stdout
+	sys.stdout = sys.stderr
+	try:
+		yield stdout
+	finally:
+		sys.stdout = stdout
+
+# Returns an ElementTree for source, which may be a XIB or storyboard document
+# as a string (unicode strings are parsed as UTF-8), an already parsed
+# ElementTree, or its root Element.
+def ib_parse_document(source):
+	import xml.etree.ElementTree as ET
+	import ibprofile
+	if isinstance(source, ET.ElementTree):
+		return source
+	if ET.iselement(source):
+		return ET.ElementTree(source)
+	if isinstance(source, unicode):
+		source = source.encode('utf-8')
+	with ibprofile.Phase('parse'):
+		return ET.ElementTree(ET.fromstring(str(source)))
+
+# Parses the XIB or storyboard at inpath (see ib_load_input).
+def ib_parse_input(inpath):
+	import xml.etree.ElementTree as ET
+	import ibprofile
+	with ibprofile.Phase('parse'):
+		return ib_load_input(inpath, ET.parse)
+
+# Compiles a XIB document (see ib_parse_document) and returns the nib's bytes.
+def ib_compile_xib_bytes(source):
+	import xibparser
+	return xibparser.CompileXIB(ib_parse_document(source))
+
+# Compiles a storyboard document (see ib_parse_document) and returns a
+# dictionary mapping the names of the files in the compiled storyboard to
+# their bytes.
+def ib_compile_storyboard_bytes(source, plistformat = None):
+	import xibparser
+	import ibwriter
+	sink = ibwriter.MemorySink()
+	xibparser.CompileStoryboard(ib_parse_document(source), sink, plistformat)
+	return sink.files
+
+# Returns the compile cache key for inpath, or None if there's no cache.
+def _ib_cache_key(cache, inpath, kind, options = None):
+	if cache is None:
+		return None
+	return cache.key(ib_read_input(inpath), kind, options)
+
+# Compiles a XIB into a nib. If outpath is a .zip or .tar archive, the nib is
+# stored in it under the input's name. If sink is given, the nib is written
+# to it as outpath instead. If cache is given, it is checked before parsing.
+def ib_compile_xib(inpath, outpath, sink = None, cache = None):
+	key = _ib_cache_key(cache, inpath, 'xib')
+	files = cache and cache.lookup(key)
+	if files:
+		outbytes = files['nib']
+	else:
+		outbytes = ib_compile_xib_bytes(ib_parse_input(inpath))
+		if cache:
+			cache.store(key, { 'nib' : outbytes })
+
+	ib_write_nib(inpath, outpath, outbytes, sink)
+
+# Writes the bytes of the nib compiled from inpath to outpath, or to sink if
+# it's given. If outpath is a .zip or .tar archive, the nib is stored in it
+# under the input's name.
+def ib_write_nib(inpath, outpath, outbytes, sink = None):
+	import ibwriter
+	import ibprofile
+
+	if sink is not None:
+		with ibprofile.Phase('write'):
+			sink.write(outpath, outbytes)
+		return
+
+	if ibwriter.SinkKindForPath(outpath) == 'directory':
+		sink = ibwriter.DirectorySink(os.path.dirname(outpath))
+		name = os.path.basename(outpath)
+	else:
+		sink = ibwriter.OpenSink(outpath)
+		# A XIB read from stdin has no name, so its nib is named after the archive.
+		if inpath == '-':
+			name = ibwriter.ArchiveBaseName(outpath) + ".nib"
+		else:
+			name = os.path.splitext(os.path.basename(inpath))[0] + ".nib"
+
+	with ibprofile.Phase('write'):
+		with sink:
+			sink.write(name, outbytes)
+
+# Compiles a storyboard into a folder, or into a .zip or .tar archive holding
+# the folder's contents. If sink is given, outpath is ignored. If cache is
+# given, it is checked before parsing.
+def ib_compile_storyboard(inpath, outpath, plistformat = None, sink = None, cache = None):
+	import xibparser
+	import ibwriter
+
+	key = _ib_cache_key(cache, inpath, 'storyboard', { 'plistformat' : plistformat or 'binary' })
+	files = cache and cache.lookup(key)
+	if cache and not files:
+		# Compile into memory, so the output can be stored in the cache.
+		files = ib_compile_storyboard_bytes(ib_parse_input(inpath), plistformat)
+		cache.store(key, files)
+
+	def compileto(sink):
+		if files:
+			for name in sorted(files.keys()):
+				sink.write(name, files[name])
+		else:
+			xibparser.CompileStoryboard(ib_parse_input(inpath), sink, plistformat)
+
+	if sink is not None:
+		compileto(sink)
+		return
+
+	with ibwriter.OpenSink(outpath, clean = True) as sink:
+		compileto(sink)
+
+# Returns the nib files among paths. Directories are searched for .nib files,
+# including those in compiled storyboards, and paths containing wildcards are
+# expanded like in the shell.
+def ib_collect_nibs(paths):
+	import glob
+	nibs = [ ]
+	for path in paths:
+		if any(c in path for c in '*?['):
+			nibs.extend(ib_collect_nibs(sorted(glob.glob(path))))
+		elif not os.path.isdir(path):
+			nibs.append(path)
+		else:
+			for dirpath, dirnames, filenames in os.walk(path):
+				dirnames.sort()
+				nibs.extend(os.path.join(dirpath, f) for f in sorted(filenames) if f.endswith(".nib"))
+	return nibs
+
+# Applies the substitutions in the JSON file at specpath (see nibpatch) to
+# compiled nibs (see ib_collect_nibs). Nibs are patched in place, unless outpath is given for
+# a single input. Returns the list of (path, error) tuples for the nibs that
+# couldn't be patched.
+def ib_patch(paths, outpath, specpath):
+	import traceback
+	import nibpatch
+	values, classes = nibpatch.LoadSubstitutions(specpath)
+
+	nibs = ib_collect_nibs(paths)
+	failures = [ ]
+	total = 0
+	for nib in nibs:
+		try:
+			count = nibpatch.PatchNibFile(nib, outpath or nib, values, classes)
+		except Exception:
+			failures.append((nib, traceback.format_exc()))
+			print "FAILED %s" % (nib)
+			print failures[-1][1]
+			continue
+		if count:
+			print "patched %s (%d substitutions)" % (nib, count)
+		total += count
+
+	print "%d substitutions in %d nibs, %d failed." % (total, len(nibs), len(failures))
+	return failures
+
+# Decodes one nib for ib_inspect. Runs in a worker process, so errors are
+# returned rather than raised.
+def _ib_inspect_job(path):
+	import traceback
+	import ibdump
+	try:
+		filebytes, nib = ibdump.readNibFile(path)
+		if nib is None:
+			return (path, None, "Not a NIBArchive file.")
+		stats = ibdump.nibStatistics(nib)
+		stats['bytes'] = len(filebytes)
+		return (path, stats, None)
+	except Exception:
+		return (path, None, traceback.format_exc().strip().splitlines()[-1])
+
+# Decodes many nibs (see ib_collect_nibs) in a pool of jobs worker processes
+# and prints a summary of each, followed by totals, the most common classes
+# and keys, and a histogram of value encodings over all of them. fmt 'json'
+# prints the same as a JSON document. Files that can't be decoded are
+# reported and skipped. Returns the list of (path, error) tuples for them.
+def ib_inspect(paths, jobs = None, fmt = None, top = 10):
+	import collections
+	import multiprocessing
+
+	nibs = ib_collect_nibs(paths)
+	jobs = jobs or multiprocessing.cpu_count()
+	if jobs > 1 and len(nibs) > 1:
+		pool = multiprocessing.Pool(min(jobs, len(nibs)))
+		results = list(pool.imap_unordered(_ib_inspect_job, nibs, max(1, len(nibs) / (jobs * 8))))
+		pool.close()
+		pool.join()
+	else:
+		results = [ _ib_inspect_job(path) for path in nibs ]
+	results.sort()
+
+	columns = [ 'objects', 'keys', 'values', 'classes', 'nested', 'bytes' ]
+	totals = dict((column, 0) for column in columns)
+	classcounts = collections.Counter()
+	keycounts = collections.Counter()
+	encodings = collections.Counter()
+	files = [ ]
+	failures = [ ]
+	for path, stats, error in results:
+		if error:
+			failures.append((path, error))
+			continue
+		for column in columns:
+			totals[column] += stats[column]
+		classcounts.update(stats['classcounts'])
+		keycounts.update(stats['keycounts'])
+		encodings.update(stats['encodings'])
+		files.append((path, stats))
+
+	if fmt == 'json':
+		import json
+		summary = {
+			'files' : [ dict([ ('path', path) ] + [ (c, stats[c]) for c in columns ]) for path, stats in files ],
+			'failures' : [ { 'path' : path, 'error' : error } for path, error in failures ],
+			'totals' : dict(totals, files = len(files)),
+			'classes' : [ { 'class' : name, 'count' : count } for name, count in classcounts.most_common(top) ],
+			'keys' : [ { 'key' : name, 'count' : count } for name, count in keycounts.most_common(top) ],
+			'encodings' : dict(('0x%02X' % (encoding), count) for encoding, count in encodings.items()),
+		}
+		print json.dumps(summary, indent = 1, sort_keys = True)
+		return failures
+
+	row = "%-50s" + " %9s" * len(columns)
+	print row % tuple([ "file" ] + columns)
+	for path, stats in files:
+		print row % tuple([ path ] + [ stats[c] for c in columns ])
+	for path, error in failures:
+		print "FAILED %s: %s" % (path, error)
+	print row % tuple([ "total (%d files)" % (len(files)) ] + [ totals[c] for c in columns ])
+
+	for title, counter in [ ("classes", classcounts), ("keys", keycounts) ]:
+		print
+		print "Top %s:" % (title)
+		for name, count in counter.most_common(top):
+			print "%9d  %s" % (count, name)
+
+	print
+	print "Value encodings:"
+	for encoding, count in sorted(encodings.items()):
+		print "%9d  0x%02X" % (count, encoding)
+
+	print
+	print "%d inspected, %d failed." % (len(files), len(failures))
+	return failures
+
+# Prints which classes and keys the bytes of compiled nibs (see
+# ib_collect_nibs) go to, summed over all of them (see nibsize). fmt 'json'
+# prints the report as a JSON document. Returns the list of (path, error)
+# tuples for the files that couldn't be decoded.
+def ib_size_report(paths, fmt = None):
+	import collections
+	import nibsize
+
+	total = { 'bytes' : 0, 'sizes' : collections.Counter(), 'nested' : [ ] }
+	nibs = ib_collect_nibs(paths)
+	failures = [ ]
+	for path in nibs:
+		try:
+			bytes = ib_read_input(path)
+			if not bytes.startswith("NIBArchive"):
+				raise ValueError("Not a NIBArchive file.")
+			nibsize.AddReport(total, nibsize.NibSizeReport(bytes), path if len(nibs) > 1 else None)
+		except Exception as e:
+			failures.append((path, "%s: %s" % (e.__class__.__name__, e)))
+
+	if fmt == 'json':
+		print nibsize.FormatSizeReportJSON(total)
+	else:
+		if len(nibs) > 1:
+			print "%d nibs" % (len(nibs) - len(failures))
+		print nibsize.FormatSizeReport(total)
+	for path, error in failures:
+		print >> sys.stderr, "FAILED %s: %s" % (path, error)
+	return failures
+
+# Prints the structural differences between two nibs (see nibdiff), and
+# returns them.
+def ib_diff(patha, pathb):
+	import nibdiff
+	differences = nibdiff.DiffNibs(ib_read_input(patha), ib_read_input(pathb))
+	for difference in differences:
+		print nibdiff.FormatDifference(difference)
+	if not differences:
+		print "%s and %s are equal." % (patha, pathb)
+	return differences
+
+def ib_dump(inpath, shortflags, fmt = None, maxdepth = None):
 	showencoding = 'e' in shortflags
-	ibdump.ibdump(inpath, showencoding)
+	import ibdump
+	ibdump.ibdump(inpath, showencoding, ib_load_input(inpath, ibdump.readNibFile), fmt, maxdepth)
 
 if __name__ == '__main__':
 	main()
\ No newline at end of file
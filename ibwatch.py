@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+
+''' Watch mode: recompiles XIBs and storyboards as they change.
+
+`ibtool.py --watch <dir> --out <dir>` stays resident with its imports
+warm, and recompiles only the files that changed into a mirror of the
+source tree. Changes are picked up with inotify on Linux (through ctypes, so
+no extra packages are needed), and by polling mtimes everywhere else.
+'''
+
+class _PollWaiter(object):
+	def __init__(self, interval):
+		self._interval = interval
+
+	def watch(self, dirpath):
+		pass
+
+	def wait(self):
+		time.sleep(self._interval)
+
+
+class _InotifyWaiter(object):
+	# IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_CLOSE_WRITE
+	_MASK = 0x2 | 0x40 | 0x80 | 0x100 | 0x200 | 0x8
+	_IN_NONBLOCK = 0x800
+	_IN_CLOEXEC = 0x80000
+
+	def __init__(self):
+		import ctypes
+		import ctypes.util
+		libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+		self._libc = libc
+		self._fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+		if self._fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+		self._watched = set()
+
+	def watch(self, dirpath):
+		if dirpath in self._watched:
+			return
+		if self._libc.inotify_add_watch(self._fd, dirpath, self._MASK) >= 0:
+			self._watched.add(dirpath)
+
+	# Blocks until something in a watched directory changes, then drains
+	# the pending events. The caller rescans, so the events aren't decoded.
+	def wait(self):
+		import select
+		select.select([ self._fd ], [ ], [ ])
+		time.sleep(0.01) # Let editors finish their write-and-rename dance.
+		try:
+			while os.read(self._fd, 65536):
+				pass
+		except OSError:
+			pass
+
+
+def _makeWaiter(interval):
+	if sys.platform.startswith('linux'):
+		try:
+			return _InotifyWaiter()
+		except (OSError, AttributeError):
+			pass
+	return _PollWaiter(interval)
+
+def _stamp(path):
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return (st.st_mtime, st.st_size)
+
+
+# Watches srcdir and compiles changed .xib and .storyboard files into outdir.
+# Files whose outputs are missing or older than the source are compiled on
+# startup. Runs until interrupted, or for one pass if once is set. With
+# verify, compiled nibs are checked like ibtool --verify does.
+def Watch(srcdir, outdir, plistformat = None, cache = None, interval = 0.1, once = False, verify = False):
+	import traceback
+	import ibtool
+
+	# Warm the imports before the first edit. Parsed inputs aren't cached:
+	# every compile here is of a file that just changed.
+	import xml.etree.ElementTree
+	import xibparser
+	import genlib
+	import ibwriter
+
+	waiter = _makeWaiter(interval)
+	stamps = { }
+
+	def outdated(inpath, outpath):
+		outstamp = _stamp(outpath)
+		if os.path.isdir(outpath):
+			outstamp = _stamp(os.path.join(outpath, "Info.plist"))
+		return outstamp is None or outstamp[0] < stamps[inpath][0]
+
+	def scan(initial):
+		changed = [ ]
+		for dirpath, dirnames, filenames in os.walk(srcdir):
+			waiter.watch(dirpath)
+		for inpath, outpath in ibtool.ib_collect_batch_inputs([ srcdir ], outdir):
+			stamp = _stamp(inpath)
+			if stamp is None:
+				continue
+			previous = stamps.get(inpath)
+			stamps[inpath] = stamp
+			if (initial and outdated(inpath, outpath)) or (not initial and previous != stamp):
+				changed.append((inpath, outpath))
+		return changed
+
+	def compile(inpath, outpath):
+		start = time.time()
+		try:
+			outparent = os.path.dirname(outpath)
+			if outparent and not os.path.isdir(outparent):
+				os.makedirs(outparent)
+			ibtool.ib_compile(inpath, outpath, plistformat, cache, verify)
+		except Exception:
+			print "FAILED %s" % (inpath)
+			print traceback.format_exc()
+			return
+		print "compiled %s -> %s (%.0f ms)" % (inpath, outpath, (time.time() - start) * 1000)
+
+	print "Watching %s, compiling into %s" % (srcdir, outdir)
+	sys.stdout.flush()
+
+	changed = scan(True)
+	while True:
+		for inpath, outpath in changed:
+			compile(inpath, outpath)
+		sys.stdout.flush()
+		if once:
+			return
+		try:
+			waiter.wait()
+		except KeyboardInterrupt:
+			return
+		changed = scan(False)
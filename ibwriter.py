@@ -0,0 +1,236 @@
+import os
+
+''' Output sinks for compiled files.
+
+Every compiled artifact is handed to a sink as a (name, bytes) pair, where
+name is relative to the output (e.g. "Info.plist" inside a storyboard).
+Sinks decide where the bytes end up: a directory, a zip or tar archive
+written in a single pass, or a dictionary in memory.
+
+threading and Queue are imported where they are needed, to keep them off
+the startup path of single XIB compiles.
+'''
+
+class OutputSink(object):
+	# Number of threads AsyncSinkWriter may use to write to this sink.
+	# 0 means writes are cheap enough to be done inline.
+	writethreads = 1
+
+	def write(self, name, data):
+		raise NotImplementedError()
+
+	def close(self):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		self.close()
+
+
+class DirectorySink(OutputSink):
+	writethreads = 2
+
+	# If clean is set, an existing directory at path is removed first.
+	def __init__(self, path, clean = False):
+		self.path = path
+		if clean and os.path.isdir(path):
+			import shutil
+			shutil.rmtree(path)
+		if path and not os.path.isdir(path):
+			os.makedirs(path)
+
+	def write(self, name, data):
+		fullpath = os.path.join(self.path, name)
+		dirname = os.path.dirname(fullpath)
+		if dirname and not os.path.isdir(dirname):
+			try:
+				os.makedirs(dirname)
+			except OSError:
+				if not os.path.isdir(dirname):
+					raise
+		with open(fullpath, 'wb') as fl:
+			fl.write(data)
+
+
+class ZipSink(OutputSink):
+	def __init__(self, path_or_file, prefix = ""):
+		import zipfile
+		import threading
+		self._zip = zipfile.ZipFile(path_or_file, 'w', zipfile.ZIP_DEFLATED)
+		self._prefix = prefix
+		self._lock = threading.Lock()
+
+	def write(self, name, data):
+		with self._lock:
+			self._zip.writestr(self._prefix + name, str(data))
+
+	def close(self):
+		self._zip.close()
+
+
+class TarSink(OutputSink):
+	# compression is one of '', 'gz' or 'bz2'. Archives are written as a
+	# stream, so path_or_file may also be a non-seekable file like stdout.
+	def __init__(self, path_or_file, prefix = "", compression = ""):
+		import tarfile
+		import threading
+		mode = 'w|' + compression
+		if isinstance(path_or_file, basestring):
+			self._tar = tarfile.open(path_or_file, mode)
+		else:
+			self._tar = tarfile.open(fileobj = path_or_file, mode = mode)
+		self._prefix = prefix
+		self._lock = threading.Lock()
+
+	def write(self, name, data):
+		import tarfile
+		import time
+		from cStringIO import StringIO
+
+		info = tarfile.TarInfo(self._prefix + name)
+		info.size = len(data)
+		info.mtime = int(time.time())
+		info.mode = 0644
+		with self._lock:
+			self._tar.addfile(info, StringIO(str(data)))
+
+	def close(self):
+		self._tar.close()
+
+
+class MemorySink(OutputSink):
+	writethreads = 0
+
+	def __init__(self):
+		self.files = { }	# name -> bytes
+
+	def write(self, name, data):
+		self.files[name] = str(data)
+
+
+class StreamSink(OutputSink):
+	''' Writes file contents to a stream as-is, e.g. a single nib to stdout. '''
+	writethreads = 0
+
+	def __init__(self, stream):
+		self._stream = stream
+
+	def write(self, name, data):
+		self._stream.write(str(data))
+
+	def close(self):
+		self._stream.flush()
+
+
+# Returns the kind of sink to use for the given output path:
+# 'zip', 'tar', or 'directory'.
+def SinkKindForPath(path):
+	if path.endswith('.zip'):
+		return 'zip'
+	for suffix in _TAR_SUFFIXES:
+		if path.endswith(suffix):
+			return 'tar'
+	return 'directory'
+
+_TAR_SUFFIXES = ['.tar', '.tar.gz', '.tgz', '.tar.bz2']
+
+# Returns the file name of an archive path without its suffix, e.g. 'Main'
+# for build/Main.tar.gz.
+def ArchiveBaseName(path):
+	name = os.path.basename(path)
+	for suffix in ['.zip'] + _TAR_SUFFIXES:
+		if name.endswith(suffix):
+			return name[0 : -len(suffix)]
+	return name
+
+# Opens a sink for the given path, picking the archive type by extension.
+# Anything that isn't a zip or tar archive is treated as a directory.
+def OpenSink(path, clean = False):
+	kind = SinkKindForPath(path)
+	if kind == 'zip':
+		return ZipSink(path)
+	if kind == 'tar':
+		compression = ''
+		if path.endswith('gz'):
+			compression = 'gz'
+		elif path.endswith('bz2'):
+			compression = 'bz2'
+		return TarSink(path, compression = compression)
+	return DirectorySink(path, clean)
+
+
+class AsyncSinkWriter(object):
+	''' Background writing of compiled files.
+
+	Encoding stays on the calling thread, while a small pool of writer threads
+	hands the encoded files to the sink. The queue between them is bounded, so
+	write() blocks once too many encoded buffers are waiting to be written.
+	'''
+
+	def __init__(self, sink, threads = None, maxpending = 8):
+		import threading
+		import Queue
+		self._sink = sink
+		self._queue = Queue.Queue(maxpending)
+		self._error = None
+		self._threads = [ ]
+		if threads is None:
+			threads = sink.writethreads
+		for i in range(0, threads):
+			t = threading.Thread(target = self._run, name = "AsyncSinkWriter-%d" % (i))
+			t.daemon = True
+			t.start()
+			self._threads.append(t)
+
+	def _run(self):
+		while True:
+			item = self._queue.get()
+			try:
+				if item is None:
+					return
+				name, data = item
+				if self._error is None:
+					self._sink.write(name, data)
+			except Exception as e:
+				self._error = self._error or e
+			finally:
+				self._queue.task_done()
+
+	# Queues data to be written as name. Blocks while the queue is full.
+	# The caller must not modify data after handing it off.
+	def write(self, name, data):
+		import ibprofile
+		if self._error is not None:
+			raise self._error
+		with ibprofile.Phase('write'):
+			if not self._threads:
+				self._sink.write(name, data)
+				return
+			self._queue.put((name, data))
+
+	# Waits for all pending writes, stops the writer threads and re-raises
+	# the first write error, if any. The sink itself is left open.
+	def close(self):
+		import ibprofile
+		with ibprofile.Phase('write'):
+			for t in self._threads:
+				self._queue.put(None)
+			for t in self._threads:
+				t.join()
+		self._threads = [ ]
+		if self._error is not None:
+			raise self._error
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		if exc_type is None:
+			self.close()
+			return
+		try:
+			self.close()
+		except Exception:
+			pass # Don't mask the original exception.
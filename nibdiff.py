@@ -0,0 +1,217 @@
+import re
+import hashlib
+
+import ibdump
+
+''' Structural comparison of compiled nibs.
+
+Every object gets a content hash computed bottom-up from its class, its keys
+and values, and the hashes of the objects it references, so two objects hash
+the same if the subgraphs below them are equal, wherever they are in their
+archives. UpstreamPlaceholder identifiers, which are random on every compile,
+are normalized before hashing. References back to an object that is still
+being hashed (cycles) are hashed by their distance up the reference chain.
+
+Comparing the root hashes tells whether two nibs are semantically equal.
+DiffNibs walks both object graphs from the root at the same time, skips
+every pair of subgraphs whose hashes match, and reports the values that
+differ, addressed by their key path from the root object.
+'''
+
+_PLACEHOLDER = re.compile(r'UpstreamPlaceholder-[A-Za-z0-9-]+')
+
+def _normalize(value):
+	if isinstance(value, str):
+		return _PLACEHOLDER.sub('UpstreamPlaceholder-*', value)
+	return value
+
+class _Graph(object):
+	''' A decoded nib with the content hash of each of its objects. '''
+
+	def __init__(self, bytes):
+		objects, keys, values, classes = ibdump.readNibSectionsFromBytes(bytes)
+		self.classes = [ classes[o[0]] for o in objects ]
+		self.values = [ [ (keys[k], v, e) for k, v, e in values[o[1] : o[1] + o[2]] ] for o in objects ]
+		self.nested = { }	# (object index, value index) -> _Graph
+		self.hashes = self._hashObjects()
+
+	def nestedGraph(self, index, v_idx):
+		key, value, encoding = self.values[index][v_idx]
+		if (index, v_idx) not in self.nested:
+			subnib = ibdump.nestedArchive(key, value, encoding)
+			self.nested[(index, v_idx)] = subnib and _Graph(subnib.data)
+		return self.nested[(index, v_idx)]
+
+	# Returns the token a non-reference value contributes to its object's hash.
+	def _valueToken(self, index, v_idx):
+		key, value, encoding = self.values[index][v_idx]
+		nested = self.nestedGraph(index, v_idx)
+		if nested is not None:
+			return "%s=archive:%s" % (key, nested.hashes[0] if nested.hashes else '')
+		return "%s=%d:%r" % (key, encoding, _normalize(value))
+
+	# Hashes all objects depth first, starting from the root object, without
+	# recursion so deep view hierarchies don't hit the recursion limit.
+	def _hashObjects(self):
+		hashes = [ None ] * len(self.classes)
+		depths = { }	# index of each object on the stack -> its depth
+		for root in range(0, len(hashes)):
+			if hashes[root] is not None:
+				continue
+			stack = [ [ root, 0, [ self.classes[root] ] ] ]
+			depths[root] = 0
+			while stack:
+				frame = stack[-1]
+				index, v_idx, tokens = frame
+				if v_idx == len(self.values[index]):
+					stack.pop()
+					del depths[index]
+					hashes[index] = hashlib.sha1('\0'.join(tokens)).hexdigest()
+					if stack:
+						parent = stack[-1]
+						key = self.values[parent[0]][parent[1] - 1][0]
+						parent[2].append("%s=@%s" % (key, hashes[index]))
+					continue
+
+				frame[1] += 1
+				key, value, encoding = self.values[index][v_idx]
+				if encoding != 0x0A:
+					tokens.append(self._valueToken(index, v_idx))
+					continue
+				child = int(value)
+				if hashes[child] is not None:
+					tokens.append("%s=@%s" % (key, hashes[child]))
+				elif child in depths:
+					tokens.append("%s=@cycle-%d" % (key, len(stack) - 1 - depths[child]))
+				else:
+					depths[child] = len(stack)
+					stack.append([ child, 0, [ self.classes[child] ] ])
+		return hashes
+
+
+# Returns the content hash of the nib's root object.
+def NibHash(bytes):
+	graph = _Graph(bytes)
+	return graph.hashes[0] if graph.hashes else None
+
+# Returns whether two nibs are equal apart from object order and
+# placeholder identifiers.
+def NibsEqual(a, b):
+	return NibHash(a) == NibHash(b)
+
+def _describe(graph, index, v_idx):
+	key, value, encoding = graph.values[index][v_idx]
+	if encoding == 0x0A:
+		child = int(value)
+		return "<%s %s>" % (graph.classes[child], value)
+	if graph.nestedGraph(index, v_idx) is not None:
+		return "<NIBArchive, %d bytes>" % (len(value))
+	text = repr(value)
+	if len(text) > 80:
+		text = text[0:77] + "..."
+	return text
+
+# Pairs up the values two objects have for the same key. Values of keys that
+# occur once are paired directly. For repeated keys, like the items of an
+# array, references to equal subgraphs are paired first, and the rest in
+# order. Yields (a value index or None, b value index or None, position).
+def _pairValues(ga, a, a_idxs, gb, b, b_idxs):
+	if len(a_idxs) == 1 and len(b_idxs) == 1:
+		yield (a_idxs[0], b_idxs[0], None)
+		return
+
+	def hashof(graph, index, v_idx):
+		key, value, encoding = graph.values[index][v_idx]
+		if encoding == 0x0A:
+			return graph.hashes[int(value)]
+		return graph._valueToken(index, v_idx)
+
+	unmatched = { }
+	for b_pos, b_idx in enumerate(b_idxs):
+		unmatched.setdefault(hashof(gb, b, b_idx), [ ]).append(b_pos)
+	matched = set()
+	rest = [ ]
+	for a_pos, a_idx in enumerate(a_idxs):
+		candidates = unmatched.get(hashof(ga, a, a_idx))
+		if candidates:
+			matched.add(candidates.pop(0))
+		else:
+			rest.append(a_pos)
+	restb = [ b_pos for b_pos in range(0, len(b_idxs)) if b_pos not in matched ]
+	for i in range(0, max(len(rest), len(restb))):
+		a_pos = rest[i] if i < len(rest) else None
+		b_pos = restb[i] if i < len(restb) else None
+		yield (a_idxs[a_pos] if a_pos is not None else None, b_idxs[b_pos] if b_pos is not None else None, a_pos if a_pos is not None else b_pos)
+
+# Returns the differences between the object graphs ga and gb as a list of
+# (kind, path, old, new) tuples, where kind is '~' for a changed value or
+# class, '-' for a value only in a and '+' for a value only in b.
+def _diffGraphs(ga, gb, prefix):
+	differences = [ ]
+	if not ga.hashes or not gb.hashes:
+		if ga.hashes != gb.hashes:
+			differences.append(('~', prefix, "%d objects" % len(ga.hashes), "%d objects" % len(gb.hashes)))
+		return differences
+
+	import collections
+	work = collections.deque([ (0, 0, prefix + ga.classes[0]) ])
+	visited = set()
+	while work:
+		a, b, path = work.popleft()
+		if (a, b) in visited or ga.hashes[a] == gb.hashes[b]:
+			continue
+		visited.add((a, b))
+
+		if ga.classes[a] != gb.classes[b]:
+			differences.append(('~', path, "class %s" % (ga.classes[a]), "class %s" % (gb.classes[b])))
+
+		keysa = { }
+		keysb = { }
+		order = [ ]
+		for v_idx, (key, value, encoding) in enumerate(ga.values[a]):
+			if key not in keysa:
+				order.append(key)
+			keysa.setdefault(key, [ ]).append(v_idx)
+		for v_idx, (key, value, encoding) in enumerate(gb.values[b]):
+			if key not in keysa and key not in keysb:
+				order.append(key)
+			keysb.setdefault(key, [ ]).append(v_idx)
+
+		for key in order:
+			for a_idx, b_idx, position in _pairValues(ga, a, keysa.get(key, [ ]), gb, b, keysb.get(key, [ ])):
+				keypath = path if key == 'UINibEncoderEmptyKey' else path + "." + key
+				if position is not None:
+					keypath += "[%d]" % (position)
+				if b_idx is None:
+					differences.append(('-', keypath, _describe(ga, a, a_idx), None))
+					continue
+				if a_idx is None:
+					differences.append(('+', keypath, None, _describe(gb, b, b_idx)))
+					continue
+
+				keya, valuea, encodinga = ga.values[a][a_idx]
+				keyb, valueb, encodingb = gb.values[b][b_idx]
+				if encodinga == 0x0A and encodingb == 0x0A:
+					work.append((int(valuea), int(valueb), keypath))
+					continue
+				nesteda = ga.nestedGraph(a, a_idx)
+				nestedb = gb.nestedGraph(b, b_idx)
+				if nesteda is not None and nestedb is not None:
+					differences.extend(_diffGraphs(nesteda, nestedb, keypath + " > "))
+				elif encodinga != encodingb or _normalize(valuea) != _normalize(valueb):
+					differences.append(('~', keypath, _describe(ga, a, a_idx), _describe(gb, b, b_idx)))
+	return differences
+
+# Returns the differences between the nibs a and b (see _diffGraphs). An
+# empty list means they are equal apart from object order and placeholder
+# identifiers.
+def DiffNibs(a, b):
+	return _diffGraphs(_Graph(a), _Graph(b), "")
+
+def FormatDifference(difference):
+	kind, path, old, new = difference
+	if kind == '-':
+		return "- %s: %s" % (path, old)
+	if kind == '+':
+		return "+ %s: %s" % (path, new)
+	return "~ %s: %s -> %s" % (path, old, new)
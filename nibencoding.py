@@ -25,10 +25,10 @@ def WriteNib(nib):
 	vals = nib[2]
 	clss = nib[3]
 
-	objs_section = _nibWriteObjectsSection(objs)
-	keys_section = _nibWriteKeysSection(keys)
-	vals_section = _nibWriteValuesSection(vals)
-	clss_section = _nibWriteClassesSection(clss)
+	objs_section = WriteObjectsSection(objs)
+	keys_section = WriteKeysSection(keys)
+	vals_section = WriteValuesSection(vals)
+	clss_section = WriteClassesSection(clss)
 
 	header_size = 50
 	objs_start = header_size
@@ -49,7 +49,12 @@ def WriteNib(nib):
 
 	return bytes
 
-def _nibWriteFlexNumber(btarray, number):
+# The writers below append to or return bytearrays holding the parts of an
+# archive. They are also used by nibpatch to re-encode single values and
+# sections of existing nibs.
+
+# Appends number to btarray as a flex number.
+def WriteFlexNumber(btarray, number):
 	cur_byte = 0
 	while True:
 		cur_byte = number & 0x7F
@@ -60,36 +65,38 @@ def _nibWriteFlexNumber(btarray, number):
 	cur_byte |= 0x80
 	btarray.append(cur_byte)
 
-def _nibWriteObjectsSection(objects):
+# objects: (class index, first value index, value count) tuples.
+def WriteObjectsSection(objects):
 	bytes = bytearray()
 	for obj in objects:
-		_nibWriteFlexNumber(bytes, obj[0])
-		_nibWriteFlexNumber(bytes, obj[1])
-		_nibWriteFlexNumber(bytes, obj[2])
+		WriteFlexNumber(bytes, obj[0])
+		WriteFlexNumber(bytes, obj[1])
+		WriteFlexNumber(bytes, obj[2])
 	return bytes
 
-def _nibWriteKeysSection(keys):
+def WriteKeysSection(keys):
 	bytes = bytearray()
 	for key in keys:
-		_nibWriteFlexNumber(bytes, len(key))
+		WriteFlexNumber(bytes, len(key))
 		bytes.extend(key)
 	return bytes
 
-def _nibWriteClassesSection(classes):
+def WriteClassesSection(classes):
 	bytes = bytearray()
 	for cls in classes:
-		_nibWriteFlexNumber(bytes, len(cls) + 1)
+		WriteFlexNumber(bytes, len(cls) + 1)
 		bytes.append(0x80)
 		bytes.extend(cls)
 		bytes.append(0x00)
 	return bytes
 
-def _nibWriteValuesSection(values):
+# values: (key index, encoding, value) tuples.
+def WriteValuesSection(values):
 	bytes = bytearray()
 	for value in values:
 		keyidx = value[0]
 		encoding_type = value[1]
-		_nibWriteFlexNumber(bytes, keyidx)
+		WriteFlexNumber(bytes, keyidx)
 		bytes.append(encoding_type)
 
 		if encoding_type == NIB_TYPE_FALSE:
@@ -110,13 +117,13 @@ def _nibWriteValuesSection(values):
 			bytes.append(value[2])
 			continue
 		if encoding_type == NIB_TYPE_SHORT:
-			bytes.append(struct.pack("<H", value[2]))
+			bytes.extend(struct.pack("<H", value[2]))
 			continue
 		if encoding_type == NIB_TYPE_STRING: # TODO struct support (Nibs use this encoding for CGRect)
 			v = value[2]
 			if isinstance(v, unicode):
 				v = v.encode('utf-8')
-			_nibWriteFlexNumber(bytes, len(v))
+			WriteFlexNumber(bytes, len(v))
 			bytes.extend(v)
 			continue
 		if encoding_type == NIB_TYPE_DOUBLE:
@@ -125,4 +132,4 @@ def _nibWriteValuesSection(values):
 
 		raise Exception("Bad encoding type: " + str(encoding_type))
 
-	return bytes
\ No newline at end of file
+	return bytes
@@ -0,0 +1,264 @@
+import os
+import struct
+
+import ibdump
+import nibencoding
+
+''' Rewrites values and class names in compiled nibs without recompiling.
+
+Substitutions are given as a dictionary, or a list of pairs, mapping (class
+name, key, old value) to the new value, where the class name and key may be
+None to match any. Values are compared as ibdump decodes them, type and all:
+strings, integers, floats, booleans, tuples of floats for encoded
+CGPoints/CGRects etc, and '@N' for object references, so a rule for True
+doesn't rewrite the integer 1. A new value must have the old value's type,
+except that integers may replace floats. Class renames are a separate old
+name -> new name dictionary.
+
+Only the values that change are re-encoded, everything else is copied as-is,
+and the header offsets of the sections that moved are updated. Archives
+embedded in NS.bytes values (e.g. table view cell prototypes) are patched too.
+'''
+
+# struct formats of the numeric value encodings.
+_NUMBER_FORMATS = { 0x00 : "<B", 0x01 : "<H", 0x02 : "<I", 0x03 : "<q", 0x06 : "<f", 0x07 : "<d" }
+
+# The integer encodings, narrowest first, and the smallest and largest value
+# each can hold.
+_INT_RANGES = [ (0x00, 0, 0xFF), (0x01, 0, 0xFFFF), (0x02, 0, 0xFFFFFFFF), (0x03, -(1 << 63), (1 << 63) - 1) ]
+
+# Returns the encoding for an integer that replaces a value of the given
+# encoding: the old one if it's an integer encoding the value fits in,
+# otherwise the narrowest wider one that fits.
+def _intEncoding(value, encoding):
+	if encoding not in [ 0x00, 0x01, 0x02, 0x03 ]:
+		encoding = 0x03
+	for candidate, low, high in _INT_RANGES:
+		if candidate >= encoding and low <= value <= high:
+			return candidate
+	raise Exception("Substituted value %d doesn't fit in a 64-bit integer." % (value))
+
+# Returns the kind of a decoded or substituted value that rules and
+# replacements have to match: 'bool', 'int', 'float', 'string', 'floats'
+# (a tuple), 'nil' or 'object'.
+def _valueKind(value):
+	if value is True or value is False:
+		return 'bool'
+	if isinstance(value, ibdump.NibObjectRef):
+		return 'object'
+	if isinstance(value, (int, long)):
+		return 'int'
+	if isinstance(value, float):
+		return 'float'
+	if isinstance(value, (basestring, bytearray)):
+		return 'string'
+	if isinstance(value, tuple):
+		return 'floats'
+	if value is None:
+		return 'nil'
+	return type(value).__name__
+
+# Returns replacement as a value of the same kind as the value of key it
+# replaces, converting integers that replace floats. Raises an exception for
+# any other change of kind. Object references are checked by _checkObjectRef.
+def _checkReplacement(key, value, replacement):
+	oldkind, newkind = _valueKind(value), _valueKind(replacement)
+	if oldkind == newkind:
+		return replacement
+	if oldkind == 'float' and newkind == 'int':
+		return float(replacement)
+	raise Exception("The %s value %r of key %s can't be replaced by the %s %r." % (oldkind, value, key, newkind, replacement))
+
+# Raises an exception unless replacement can stand in for the object
+# reference value of key: it must be another reference written as '@N', with
+# N the index of one of the count objects of the archive, or None.
+def _checkObjectRef(key, value, replacement, count):
+	if replacement is None:
+		return
+	if isinstance(replacement, (int, long)) and not isinstance(replacement, bool):
+		raise Exception("The object reference %s of key %s can't be replaced by the number %d; write a reference as '@%d'." % (value, key, replacement, replacement))
+	if not isinstance(replacement, basestring) or not replacement.startswith('@'):
+		raise Exception("The object reference %s of key %s can only be replaced by another reference ('@N') or null, not %r." % (value, key, replacement))
+	try:
+		index = int(replacement[1:])
+	except ValueError:
+		raise Exception("%r, the replacement of the object reference %s of key %s, isn't a reference; they are written '@N' with N an object index." % (replacement, value, key))
+	if not 0 <= index < count:
+		raise Exception("%s, the replacement of the object reference %s of key %s, refers to no object; the archive has %d." % (replacement, value, key, count))
+
+# Returns the encoded bytes of a value with the given key index. The encoding
+# of the old value is kept where the new value allows it.
+def _encodeValue(key_idx, encoding, value):
+	if value is True or value is False:
+		encoding = nibencoding.NIB_TYPE_TRUE if value else nibencoding.NIB_TYPE_FALSE
+	elif isinstance(value, basestring) and value.startswith('@') and encoding == nibencoding.NIB_TYPE_OBJECT:
+		value = int(value[1:])
+	elif isinstance(value, (basestring, bytearray)):
+		encoding = nibencoding.NIB_TYPE_STRING
+	elif isinstance(value, tuple):
+		encoding = nibencoding.NIB_TYPE_STRING
+		value = '\x07' + struct.pack('<' + 'd' * len(value), *value)
+	elif isinstance(value, float):
+		if encoding != 0x06:
+			encoding = nibencoding.NIB_TYPE_DOUBLE
+	elif isinstance(value, (int, long)):
+		encoding = _intEncoding(value, encoding)
+	elif value is None:
+		encoding = 0x09
+	else:
+		raise Exception("Can't encode substituted value %r." % (value,))
+
+	out = bytearray()
+	if encoding in _NUMBER_FORMATS:
+		nibencoding.WriteFlexNumber(out, key_idx)
+		out.append(encoding)
+		out.extend(struct.pack(_NUMBER_FORMATS[encoding], value))
+	elif encoding == 0x09:
+		nibencoding.WriteFlexNumber(out, key_idx)
+		out.append(encoding)
+	else:
+		out.extend(nibencoding.WriteValuesSection([ (key_idx, encoding, value) ]))
+	return out
+
+# Returns (patched bytes, number of substitutions made) for the nib in bytes.
+# If nothing matched, the original bytes object is returned.
+def PatchNib(bytes, values = None, classes = None):
+	values = values or { }
+	classes = classes or { }
+	if hasattr(values, 'items'):
+		values = values.items()
+
+	# Rules are keyed by the kind of their old value too, as True == 1 == 1.0
+	# in a dictionary. Object references are matched as '@N' strings.
+	rules = dict(((classname, key, _valueKind(old), old), new) for (classname, key, old), new in values)
+
+	sections = ibdump.readHeader(bytes, 14)
+	keys = ibdump.readKeys(bytes, sections[1])
+	classnames = ibdump.readClasses(bytes, sections[3])
+
+	# Values are only decoded if a substitution could apply to their key.
+	rulekeys = set(key for classname, key, kind, old in rules.keys())
+	anykey = None in rulekeys
+	candidates = set(idx for idx, key in enumerate(keys) if anykey or key in rulekeys)
+	nestedkey = keys.index('NS.bytes') if 'NS.bytes' in keys else None
+
+	owners = None
+	if any(classname is not None for classname, key, kind, old in rules.keys()):
+		owners = { }
+		for class_idx, start, count in ibdump.readObjects(bytes, sections[0], ibdump.sectionEnd(sections, 0, len(bytes))):
+			for v_idx in range(start, start + count):
+				owners[v_idx] = classnames[class_idx]
+
+	def substitute(v_idx, key, value):
+		classname = owners[v_idx] if owners is not None else None
+		if isinstance(value, ibdump.NibObjectRef):
+			value = str(value)
+		kind = _valueKind(value)
+		for rule in [ (classname, key, kind, value), (None, key, kind, value), (classname, None, kind, value), (None, None, kind, value) ]:
+			try:
+				if rule in rules:
+					return True, rules[rule]
+			except TypeError:
+				return False, None # Unhashable, so there's no rule for it.
+		return False, None
+
+	patched = 0
+	pieces = [ ]
+	copyfrom = sections[2][1]
+	for v_idx, (start, payload, end, key_idx, encoding) in enumerate(ibdump.readValueSpans(bytes, sections[2])):
+		newvalue = None
+		if key_idx == nestedkey and encoding == nibencoding.NIB_TYPE_STRING and ibdump.isNibArchive(bytes, payload, end):
+			newsub, count = PatchNib(bytes[payload : end], values, classes)
+			if count:
+				patched += count
+				newvalue = _encodeValue(key_idx, encoding, newsub)
+		if newvalue is None and key_idx in candidates:
+			if encoding == nibencoding.NIB_TYPE_STRING and bytes[payload : payload + 1] != '\x07':
+				value = bytes[payload : end]
+			else:
+				value = ibdump.readValues(bytes, (1, start))[0][1]
+			found, replacement = substitute(v_idx, keys[key_idx], value)
+			if found:
+				if encoding == nibencoding.NIB_TYPE_OBJECT:
+					_checkObjectRef(keys[key_idx], value, replacement, sections[0][0])
+				else:
+					replacement = _checkReplacement(keys[key_idx], value, replacement)
+			if found and replacement != value:
+				patched += 1
+				newvalue = _encodeValue(key_idx, encoding, replacement)
+		if newvalue is not None:
+			pieces.append(bytes[copyfrom : start])
+			pieces.append(str(newvalue))
+			copyfrom = end
+
+	renamed = [ classes.get(name, name) for name in classnames ]
+	patched += sum(1 for old, new in zip(classnames, renamed) if old != new)
+	if not patched:
+		return bytes, 0
+
+	# Rebuild the archive section by section, in the order they appear in the file.
+	order = sorted(range(0, len(sections)), key = lambda s: sections[s][1])
+	ends = { }
+	for position, s in enumerate(order):
+		ends[s] = sections[order[position + 1]][1] if position + 1 < len(order) else len(bytes)
+
+	pieces.append(bytes[copyfrom : ends[2]])
+	newsections = {
+		2 : ''.join(pieces),
+	}
+	if renamed != classnames:
+		newsections[3] = str(nibencoding.WriteClassesSection(renamed))
+
+	headersize = 14 + 4 + 8 * len(sections)
+	body = [ ]
+	offsets = { }
+	ptr = sections[order[0]][1]
+	for s in order:
+		data = newsections.get(s)
+		if data is None:
+			data = bytes[sections[s][1] : ends[s]]
+		offsets[s] = ptr
+		body.append(data)
+		ptr += len(data)
+
+	out = [ bytes[0 : 18] ]
+	for s in range(0, len(sections)):
+		out.append(struct.pack("<II", sections[s][0], offsets[s]))
+	out.append(bytes[headersize : sections[order[0]][1]])
+	out.extend(body)
+	return ''.join(out), patched
+
+def _fromJSON(value):
+	if isinstance(value, unicode):
+		return value.encode('utf-8')
+	if isinstance(value, list):
+		return tuple(_fromJSON(v) for v in value)
+	return value
+
+# Reads substitutions from a JSON file of the form
+#   { "values" : [ { "class" : "UILabel", "key" : "UIText", "old" : "Hello", "new" : "Bonjour" } ],
+#     "classes" : { "OldViewController" : "NewViewController" } }
+# where "class" and "key" are optional. Arrays stand for tuples of floats.
+# Returns the values, as a list of ((class, key, old), new) pairs, and the
+# classes dictionary to pass to PatchNib.
+def LoadSubstitutions(path):
+	import json
+	with open(path, 'rb') as fl:
+		spec = json.load(fl)
+
+	values = [ ((_fromJSON(rule.get('class')), _fromJSON(rule.get('key')), _fromJSON(rule['old'])), _fromJSON(rule['new']))
+		for rule in spec.get('values', [ ]) ]
+	classes = dict((_fromJSON(old), _fromJSON(new)) for old, new in spec.get('classes', { }).items())
+	return values, classes
+
+# Patches the nib at inpath and writes the result to outpath, which defaults
+# to inpath. Unchanged nibs are only written if outpath is a different file.
+# Returns the number of substitutions made.
+def PatchNibFile(inpath, outpath, values, classes):
+	with open(inpath, 'rb') as fl:
+		bytes = fl.read()
+	newbytes, patched = PatchNib(bytes, values, classes)
+	if patched or os.path.abspath(outpath) != os.path.abspath(inpath):
+		with open(outpath, 'wb') as fl:
+			fl.write(newbytes)
+	return patched
@@ -0,0 +1,156 @@
+import collections
+
+import ibdump
+
+''' Attributes the bytes of compiled nibs to the classes and keys that use them.
+
+Every byte of an archive is counted under a (part, class name, key) triple:
+
+  header    the file header and section table
+  objects   an object's entry in the objects table, under its class
+  keys      a key's name in the keys table
+  classes   a class's name in the classes table
+  values    a value: its key index, encoding and payload, under the class of
+            the object it belongs to and its key
+  nested    a value holding an archive (e.g. a table view cell prototype),
+            counted as a whole under its object's class and key. The nested
+            archive's own breakdown is reported separately.
+  other     bytes outside the sections, if any
+
+The parts add up to the size of the file.
+'''
+
+PARTS = [ 'header', 'objects', 'keys', 'classes', 'values', 'nested', 'other' ]
+
+# Returns the size report of the nib in bytes, a dictionary with the total
+# 'bytes', the 'sizes' Counter of (part, class, key) -> bytes, and the
+# 'nested' archives as a list of dictionaries with the 'class', 'key' and
+# 'object' index that holds them and their own size 'report'.
+def NibSizeReport(bytes):
+	sections = ibdump.readHeader(bytes, 14)
+	keys = ibdump.readKeys(bytes, sections[1])
+	classes = ibdump.readClasses(bytes, sections[3])
+	objects = ibdump.readObjects(bytes, sections[0], ibdump.sectionEnd(sections, 0, len(bytes)))
+
+	sizes = collections.Counter()
+	nested = [ ]
+	sizes[('header', None, None)] = 18 + 8 * len(sections)
+	accounted = sizes[('header', None, None)]
+
+	ptr = sections[0][1]
+	owners = [ None ] * sections[2][0]
+	for o_idx, (class_idx, start, count) in enumerate(objects):
+		entry = ptr
+		for field in range(0, 3):
+			number, length = ibdump.readFlexNumber(bytes, ptr)
+			ptr += length
+		sizes[('objects', classes[class_idx], None)] += ptr - entry
+		owners[start : start + count] = [ o_idx ] * count
+	accounted += ptr - sections[0][1]
+
+	ptr = sections[1][1]
+	for key in keys:
+		entry = ptr
+		length, size = ibdump.readFlexNumber(bytes, ptr)
+		ptr += size + length
+		sizes[('keys', None, key)] += ptr - entry
+	accounted += ptr - sections[1][1]
+
+	ptr = sections[3][1]
+	for classname in classes:
+		entry = ptr
+		length, size = ibdump.readFlexNumber(bytes, ptr)
+		ptr += size
+		if bytes[ptr] == '\x81':
+			ptr += 4
+		ptr += 1 + length
+		sizes[('classes', classname, None)] += ptr - entry
+	accounted += ptr - sections[3][1]
+
+	for v_idx, (start, payload, end, key_idx, encoding) in enumerate(ibdump.readValueSpans(bytes, sections[2])):
+		o_idx = owners[v_idx]
+		classname = classes[objects[o_idx][0]] if o_idx is not None else None
+		key = keys[key_idx]
+		if key == 'NS.bytes' and encoding == 0x08 and ibdump.isNibArchive(bytes, payload, end):
+			sizes[('nested', classname, key)] += end - start
+			nested.append({ 'class' : classname, 'key' : key, 'object' : o_idx, 'report' : NibSizeReport(bytes[payload : end]) })
+		else:
+			sizes[('values', classname, key)] += end - start
+		accounted += end - start
+
+	if len(bytes) != accounted:
+		sizes[('other', None, None)] = len(bytes) - accounted
+	return { 'bytes' : len(bytes), 'sizes' : sizes, 'nested' : nested }
+
+# Returns the report's sizes summed by the given fields of the (part, class,
+# key) triples, e.g. SumSizes(report, 0) for the size of each part.
+def SumSizes(report, *fields):
+	sums = collections.Counter()
+	for triple, size in report['sizes'].items():
+		sums[tuple(triple[f] for f in fields)] += size
+	return sums
+
+# Adds the sizes of report to total, which starts out as an empty report
+# ({ 'bytes' : 0, 'sizes' : collections.Counter(), 'nested' : [ ] }).
+def AddReport(total, report, path = None):
+	total['bytes'] += report['bytes']
+	total['sizes'].update(report['sizes'])
+	for archive in report['nested']:
+		total['nested'].append(dict(archive, path = path) if path else archive)
+
+def _jsonReport(report):
+	return {
+		'bytes' : report['bytes'],
+		'sizes' : [ { 'part' : part, 'class' : classname, 'key' : key, 'bytes' : size }
+			for (part, classname, key), size in sorted(report['sizes'].items(), key = lambda item: (-item[1], item[0])) ],
+		'nested' : [ dict((k, _jsonReport(v) if k == 'report' else v) for k, v in archive.items()) for archive in report['nested'] ],
+	}
+
+# Returns the report as a JSON document.
+def FormatSizeReportJSON(report):
+	import json
+	return json.dumps(_jsonReport(report), indent = 1, sort_keys = True)
+
+# Returns the report as text: the size of each part, followed by the top
+# classes (object entries, class names and values of their objects), the
+# top class and key pairs, and the largest nested archives.
+def FormatSizeReport(report, top = 20):
+	total = report['bytes']
+	lines = [ ]
+	def row(size, name):
+		lines.append("%10d %6.1f%%  %s" % (size, 100.0 * size / total if total else 0, name))
+
+	lines.append("%10s %7s  %s" % ("bytes", "share", "part"))
+	parts = SumSizes(report, 0)
+	for part in PARTS:
+		if parts[(part,)]:
+			row(parts[(part,)], part)
+	row(total, "total")
+
+	byclass = collections.Counter()
+	for (part, classname, key), size in report['sizes'].items():
+		if classname is not None:
+			byclass[classname] += size
+	lines.append("")
+	lines.append("Top classes:")
+	for classname, size in byclass.most_common(top):
+		row(size, classname)
+
+	bykey = collections.Counter()
+	for (part, classname, key), size in report['sizes'].items():
+		if part in [ 'values', 'nested' ]:
+			bykey["%s.%s" % (classname, key)] += size
+	lines.append("")
+	lines.append("Top values by class and key:")
+	for name, size in bykey.most_common(top):
+		row(size, name)
+
+	if report['nested']:
+		lines.append("")
+		lines.append("Largest nested archives:")
+		for archive in sorted(report['nested'], key = lambda a: -a['report']['bytes'])[0 : top]:
+			where = "%s.%s of object %d" % (archive['class'], archive['key'], archive['object'])
+			if archive.get('path'):
+				where += " in " + archive['path']
+			row(archive['report']['bytes'], where)
+	return '\n'.join(lines)
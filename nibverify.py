@@ -0,0 +1,78 @@
+import operator
+
+import ibdump
+import nibencoding
+
+''' Checks encoded nibs by decoding them again, for --verify.
+
+This sits between the encoder and the decoder, so that neither has to
+import the other.
+'''
+
+# Decodes bytes, the output of nibencoding.WriteNib(nib), with the ibdump
+# readers and checks that it holds what the nib tuples say: the same objects,
+# keys and classes, every value with its key and encoding, the same object
+# references and only to existing objects, and value ranges that stay within
+# the values.
+# Other payloads aren't compared; a payload of the wrong size shows up as
+# misplaced keys and encodings in the values that follow it.
+# Archives embedded in string values only get their header checked, since
+# they were encoded (and verified) by a CompileNibObjects call of their own.
+# Raises an Exception describing the first problem found.
+def VerifyNib(bytes, nib):
+	objs, keys, vals, clss = nib
+	bytes = str(bytes)
+
+	def fail(message):
+		raise Exception("Nib verification failed: " + message)
+
+	if bytes[0:10] != "NIBArchive" or len(bytes) < 50:
+		fail("missing NIBArchive header")
+	sections = ibdump.readHeader(bytes, 14)
+	for name, section, expected in zip([ "objects", "keys", "values", "classes" ], sections, [ objs, keys, vals, clss ]):
+		if section[0] != len(expected):
+			fail("%d %s in the header, expected %d" % (section[0], name, len(expected)))
+		if not 50 <= section[1] <= len(bytes):
+			fail("%s section at %d is outside the archive" % (name, section[1]))
+
+	decodedobjs = ibdump.readObjects(bytes, sections[0], ibdump.sectionEnd(sections, 0, len(bytes)))
+	if decodedobjs != objs and decodedobjs != [ tuple(o) for o in objs ]:
+		fail("the objects section doesn't match the encoded objects")
+	if ibdump.readKeys(bytes, sections[1]) != [ str(k) for k in keys ]:
+		fail("the keys section doesn't match the encoded keys")
+	if ibdump.readClasses(bytes, sections[3]) != [ str(c) for c in clss ]:
+		fail("the classes section doesn't match the encoded classes")
+
+	ends = [ start + count for class_idx, start, count in objs ]
+	if ends and max(ends) > len(vals):
+		fail("object values end at %d, past the last value %d" % (max(ends), len(vals)))
+
+	# The columns are compared as a whole, which is much cheaper than
+	# checking value by value; the loop only runs to report a mismatch.
+	decoded = ibdump.readValues(bytes, sections[2])
+	first, second, third = operator.itemgetter(0), operator.itemgetter(1), operator.itemgetter(2)
+	if map(first, decoded) != map(first, vals) or map(third, decoded) != map(second, vals):
+		for v_idx, (key_idx, value, encoding) in enumerate(decoded):
+			if (key_idx, encoding) != tuple(vals[v_idx][0:2]):
+				fail("value %d has key %d and encoding 0x%02X, expected key %d and encoding 0x%02X" % (v_idx, key_idx, encoding, vals[v_idx][0], vals[v_idx][1]))
+
+	refs = [ value for key_idx, value, encoding in decoded if encoding == nibencoding.NIB_TYPE_OBJECT ]
+	if refs != [ v[2] for v in vals if v[1] == nibencoding.NIB_TYPE_OBJECT ]:
+		fail("the object references don't match the encoded ones")
+	if refs and (min(refs) < 0 or max(refs) >= len(objs)):
+		fail("a value refers to object %d, but there are only %d objects" % (max(refs), len(objs)))
+
+	if 'NS.bytes' in keys:
+		nestedkey = keys.index('NS.bytes')
+		for v_idx, (key_idx, value, encoding) in enumerate(decoded):
+			if key_idx == nestedkey and encoding == nibencoding.NIB_TYPE_STRING and isinstance(value, str) and value.startswith("NIBArchive"):
+				_verifyNestedHeader(value, v_idx)
+
+# Checks that the sections of an archive embedded in value v_idx lie within it.
+def _verifyNestedHeader(data, v_idx):
+	headersize = 14 + 4 * ibdump.rword(data, 14)
+	if headersize > len(data):
+		raise Exception("Nib verification failed: the archive in value %d has a %d byte header, but only %d bytes" % (v_idx, headersize, len(data)))
+	for count, address in ibdump.readHeader(data[0 : headersize], 14):
+		if not headersize <= address <= len(data):
+			raise Exception("Nib verification failed: the archive in value %d has a section at %d, outside its %d bytes" % (v_idx, address, len(data)))
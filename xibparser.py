@@ -1,5 +1,6 @@
 
-from genlib import *
+from genlib import NibObject, NibString, NibData, NibInlineString, NibByte, NibNSNumber, NibProxyObject, CompileNibObjects
+import ibprofile
 
 '''
 TODO:
@@ -35,14 +36,28 @@ def ParseXIBObjects(element, context = None, resolveConnections = True, parent =
 	return root
 
 
-def CompileStoryboard(tree, foldername):
+# Compiles a standalone XIB document and returns the nib's bytes.
+def CompileXIB(tree):
+	objects = tree.getroot().iter('objects').next()
+	nibroot = ParseXIBObjects(objects)
+	return CompileNibObjects([nibroot])
 
-	import os
-	if os.path.isdir(foldername):
-		import shutil
-		shutil.rmtree(foldername)
+# output: An ibwriter.OutputSink, or the path of the folder to compile the storyboard into.
+def CompileStoryboard(tree, output, plistformat = None):
 
-	os.mkdir (foldername)
+	import ibwriter
+	sink = output
+	if isinstance(output, basestring):
+		sink = ibwriter.DirectorySink(output, clean = True)
+
+	with ibwriter.AsyncSinkWriter(sink) as writer:
+		_CompileStoryboardScenes(tree, writer, plistformat)
+
+	if sink is not output:
+		sink.close()
+
+# Encodes the storyboard's scenes, handing the encoded files to writer.
+def _CompileStoryboardScenes(tree, writer, plistformat):
 
 	root = tree.getroot()
 	init = root.attrib.get('initialViewController')
@@ -62,12 +77,13 @@ def CompileStoryboard(tree, foldername):
 	#  - The view controller of the scene.
 	#  - The root objects for the scene.
 	#  - The view controller nib name.
+	#  - The scene's ID.
 	# We can't write the scene nibs as we read the scenes, because some things might depend on having
 	# seen all the scenes. (e.g. Segues, which need to know how to translate ID into storyboardIdentifier)
 	scenesToWrite = []
 
-	for sceneNode in scenesNode:
-
+	# Parses the scene and returns its entry of scenesToWrite.
+	def parseScene(sceneNode):
 		toplevel = []
 
 		sceneID = sceneNode.attrib['sceneID']
@@ -118,8 +134,7 @@ def CompileStoryboard(tree, foldername):
 			root['UINibConnectionsKey'] = [ ViewConnection ] + context.viewConnections
 			# root['UINibConnectionsKey']
 
-			with open("%s/%s%s" % (foldername, viewNibFilename, ".nib"), 'wb') as fl:
-				fl.write(CompileNibObjects([root]))
+			writer.write(viewNibFilename + ".nib", CompileNibObjects([root]))
 
 
 		# Not setting the UINibName key is acceptable.
@@ -149,7 +164,11 @@ def CompileStoryboard(tree, foldername):
 		root['UINibObjectsKey'] = list(toplevel)
 		root['UINibObjectsKey'].extend(context.extraNibObjects)
 
-		scenesToWrite.append( (viewController, root, viewControllerNibName) )
+		return (viewController, root, viewControllerNibName, sceneID)
+
+	for sceneNode in scenesNode:
+		with ibprofile.Phase('scene', sceneNode.attrib['sceneID']):
+			scenesToWrite.append(parseScene(sceneNode))
 
 
 	# Do some additional processing before the scenes are written.
@@ -157,7 +176,7 @@ def CompileStoryboard(tree, foldername):
 	# all the appropriate values for relationship segues in the storyboard.
 	for finalScene in scenesToWrite:
 
-		viewController, root, viewControllerNibName = finalScene
+		viewController, root, viewControllerNibName, sceneID = finalScene
 
 		for segue in viewController.get('UIStoryboardSegueTemplates') or []:
 			dest = segue['UIDestinationViewControllerIdentifier']
@@ -188,9 +207,9 @@ def CompileStoryboard(tree, foldername):
 				rootViewController['UIParentViewController'] = viewController
 				# Maybe also set a default UINavigationItem?
 
-		bytes = CompileNibObjects([root])
-		with open("%s/%s%s" %(foldername,viewControllerNibName,".nib"), 'wb') as fl:
-			fl.write(bytes)
+		with ibprofile.Phase('scene', sceneID):
+			bytes = CompileNibObjects([root])
+			writer.write(viewControllerNibName + ".nib", bytes)
 
 		for viewController, oldProperties in resetProperties:
 			viewController.properties = oldProperties
@@ -208,10 +227,38 @@ def CompileStoryboard(tree, foldername):
 
 	print "INIT:", init
 
-	import plistlib
-	plistlib.writePlist(storyboard_info, foldername + "/Info.plist")
+	import bplist
+	writer.write("Info.plist", bplist.PlistToBytes(storyboard_info, plistformat or bplist.PLIST_FORMAT_BINARY))
 
 
+# Returns the names of the files CompileStoryboard will write for tree, in
+# the order it writes them, without parsing any objects or encoding any nibs.
+def StoryboardOutputNames(tree):
+	names = [ ]
+	scenesNode = tree.getroot().find('scenes')
+	if scenesNode is None:
+		raise Exception("The document has no <scenes>; is it a storyboard?")
+	for sceneNode in scenesNode:
+		objects = sceneNode.find('objects')
+		if objects is None:
+			raise Exception("Storyboard scene %s has no <objects>." % (sceneNode.attrib.get('sceneID')))
+		vcElem = None
+		for elem in objects:
+			if elem.attrib.get('sceneMemberID') == 'viewController' and globals().get("_xibparser_parse_" + elem.tag):
+				vcElem = elem
+		if vcElem is None:
+			raise Exception("Storyboard scene did not have associated view controller.")
+
+		vcid = vcElem.attrib['id']
+		for child in vcElem:
+			if child.attrib.get('key') == 'view' and globals().get("_xibparser_parse_" + child.tag):
+				names.append("%s-view-%s.nib" % (vcid, child.attrib.get('id')))
+
+		names.append((vcElem.attrib.get('storyboardIdentifier') or "UIViewController-" + vcid) + ".nib")
+
+	names.append("Info.plist")
+	return names
+
 def makexibid():
 	import random
 	chars = random.sample('0123456789qwertyuiopasdfghjklzxcvbnmQWERTYUIOPASDFGHJKLZXCVBNM', 10)
@@ -297,11 +344,12 @@ class ArchiveContext:
 		return None
 
 	def resolveConnections(self):
-		if not self.isStoryboard:
-			self._resolveConnections_xib()
-		else:
-			self._resolveConnections_storyboard()
-		self._resolveViewReferences()
+		with ibprofile.Phase('resolveConnections'):
+			if not self.isStoryboard:
+				self._resolveConnections_xib()
+			else:
+				self._resolveConnections_storyboard()
+			self._resolveViewReferences()
 
 	def _resolveViewReferences(self):
 		for ref in self.viewReferences:
@@ -368,7 +416,8 @@ class ArchiveContext:
 			con['UIDestination'] = dst
 
 			src_top = src.xibid in self.objects
-			dst_top = dst.xibid in self.objects
+			# Segues from buttons already point to an upstream placeholder.
+			dst_top = not isinstance(dst, NibProxyObject) and dst.xibid in self.objects
 
 			if not src_top:
 				assert(src.xibid in self.viewObjects)
@@ -428,7 +477,17 @@ def __xibparser_ParseXIBObject(ctx, elem, parent):
 	parsefn = globals().get(fnname)
 	# print "----- PARSETHING: " + tag, parsefn
 	if parsefn:
-		obj = parsefn(ctx, elem, parent)
+		# Checked here rather than with ibprofile.Phase, which would slow
+		# down every element of every compile.
+		hook = ibprofile.CurrentHook()
+		if hook is None:
+			obj = parsefn(ctx, elem, parent)
+		else:
+			hook.enter('handler', tag)
+			try:
+				obj = parsefn(ctx, elem, parent)
+			finally:
+				hook.exit('handler', tag)
 		if obj and isinstance(obj, XibObject):
 			obj.xibid = elem.attrib['id']
 		return obj